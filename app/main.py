@@ -4,18 +4,29 @@ from app.router import rent_app
 from src.database.db import init_db
 from sqlalchemy import inspect
 from src.database.db import engine
+from src.jobs import job_runner
 
 inspector = inspect(engine)
 print(f"Tables in DB: {inspector.get_table_names()}")
 
-# 启动时创建表（确保只运行一次）
-if "flats_to_rent" not in inspector.get_table_names():
-    init_db()
+# 启动时创建缺失的表并升级旧的表结构（可重复运行）
+init_db()
 
 app = FastAPI()
 
 app.include_router(rent_app)
 
+
+@app.on_event("startup")
+def resume_scrape_jobs():
+    # jobs left queued or running by a previous process
+    job_runner.resume_pending()
+
+
+@app.on_event("shutdown")
+def stop_scrape_jobs():
+    job_runner.shutdown()
+
 # 以下代码可以使用户直接利用uvicorn运行此web应用，只需python -m main
 if __name__ == "__main__":
     uvicorn.run("app.main:app")
\ No newline at end of file
@@ -1,10 +1,14 @@
-import pandas as pd
-import numpy as np
+import base64
+import json
 import logging
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, case, func, select
 from sqlalchemy.orm import Session
 from src.database import db
-from src.scrapping import wrapper
+import src.const as const
+from src.jobs import job_runner
+from src.ranking import make_profile, ranker
 import time 
 import datetime
 
@@ -23,90 +27,261 @@ def get_db():
     finally:
         database.close()
 
-@rent_app.post("/rent")
-async def scrap_location(postcode: str,
-                         loc_code: str,
-                         database: Session = Depends(get_db),
-                         pages: int = None):
-    try:
-        # Run the scraper
-        logger.info(f"Starting scraping process for postcode: {postcode}, time: {datetime.datetime.now()}")
-        if pages is not None:
-            df_result = wrapper(postcode, loc_code, pages=pages)
-        else:
-            df_result = wrapper(postcode, loc_code)
-        
-        logger.info(f"Scraping process completed, time: {datetime.datetime.now()}")
-        # Validate we got data
-        if df_result.empty:
-            logger.warning(f"No data found for postcode: {postcode}")
-            return {"message": f"No properties found for {postcode}", "inserted_count": 0}
-        
-        inserted_count = len(df_result)
-        
-        return {
-            "message": f"Successfully scraped and inserted {inserted_count} properties for {postcode}"
-        }
-    
-    except Exception as e:
-        logger.error(f"Error in scraping process for {postcode}: {str(e)}", exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Scraping failed for {postcode}: {str(e)}"
-        )
+@rent_app.post("/rent", status_code=202)
+def scrap_location(postcode: str,
+                   loc_code: str,
+                   pages: int = None):
+    # queue the scrape and return straight away, progress is at /rent/jobs/{id}
+    job = job_runner.submit(postcode, loc_code, pages)
+    logger.info(f"Queued scraping job {job['id']} for postcode: {postcode}, time: {datetime.datetime.now()}")
+    return {"message": f"Scraping job queued for {postcode}",
+            "job_id": job["id"],
+            "state": job["state"]}
+
+
+@rent_app.get("/rent/jobs")
+def get_jobs(state: str = None,
+             limit: int = 50):
+    return {"jobs": db.list_jobs(state=state, limit=limit)}
+
+
+@rent_app.get("/rent/jobs/{job_id}")
+def get_job(job_id: str):
+    job = db.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@rent_app.delete("/rent/jobs/{job_id}")
+def cancel_job(job_id: str):
+    job = job_runner.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
     
 
 @rent_app.get("/rent")
 async def get_stats_basic(database: Session = Depends(get_db)):
-    data = database.query(db.FlatsToRent).all()
-    df = pd.DataFrame([r.__dict__ for r in data])
-    if df.empty:
+    # served from the postcode_stats summary maintained on every write
+    stats_global = database.query(db.PostcodeStats.postcode,
+                                  func.sum(db.PostcodeStats.count).label("count"),
+                                  func.min(db.PostcodeStats.min_price).label("min"),
+                                  func.max(db.PostcodeStats.max_price).label("max"))\
+                           .group_by(db.PostcodeStats.postcode)\
+                           .order_by(db.PostcodeStats.postcode).all()
+    if not stats_global:
         logger.warning("No data found.")
         return {"message": "No properties found."}
-    else:
-        stats_global = df.groupby(["postcode"])["price"].agg(['count', 'min', 'max']).reset_index()
     
     # Convert to dictionary for JSON response
-    stats_dict = stats_global.to_dict(orient='records')
+    stats_dict = [row._asdict() for row in stats_global]
     return {"statistics": stats_dict}
 
 
+MERGED_PROPERTY_TYPES = ["Apartment", "Flat"]
+
+
+def encode_cursor(unique_id: str):
+    return base64.urlsafe_b64encode(unique_id.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    # validate=True rejects stray characters instead of skipping them
+    try:
+        unique_id = base64.b64decode(cursor.encode(), altchars=b"-_", validate=True).decode()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not unique_id:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return unique_id
+
+
+def listings_query(fields: list,
+                   postcode: str = None,
+                   property_type: str = None,
+                   number_of_bedroom: int = None,
+                   min_price: int = None,
+                   max_price: int = None,
+                   station: str = None,
+                   cursor: str = None):
+    table = db.FlatsToRent.__table__
+    unknown = [field for field in fields if field not in table.c]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown field(s): {', '.join(unknown)}")
+    # unique_id is the pagination key, always returned
+    if "unique_id" not in fields:
+        fields = ["unique_id"] + fields
+    query = select(*[table.c[field] for field in fields])
+
+    if postcode is not None:
+        query = query.where(table.c.postcode == postcode)
+    if property_type is not None:
+        if property_type == "Apartment/Flat":
+            query = query.where(table.c.property_type.in_(MERGED_PROPERTY_TYPES))
+        else:
+            query = query.where(table.c.property_type == property_type)
+    if number_of_bedroom is not None:
+        query = query.where(table.c.number_of_bedroom == number_of_bedroom)
+    if min_price is not None:
+        query = query.where(table.c.price >= min_price)
+    if max_price is not None:
+        query = query.where(table.c.price <= max_price)
+    if station is not None:
+        query = query.where(table.c.nearest_station == station)
+    # keyset pagination: seek past the last key instead of OFFSET
+    if cursor is not None:
+        query = query.where(table.c.unique_id > decode_cursor(cursor))
+    return query.order_by(table.c.unique_id)
+
+
+def stream_ndjson(query):
+    # own connection: the request's session is closed before streaming starts
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=1000).execute(query)
+        for row in result:
+            yield json.dumps(row._asdict(), default=str) + "\n"
+
+
+@rent_app.get("/rent/listings")
+def get_listings(database: Session = Depends(get_db),
+                 fields: str = None,
+                 postcode: str = None,
+                 property_type: str = None,
+                 number_of_bedroom: int = None,
+                 min_price: int = None,
+                 max_price: int = None,
+                 station: str = None,
+                 cursor: str = None,
+                 limit: int = Query(100, ge=1, le=1000),
+                 format: str = Query("json", pattern="^(json|ndjson)$")):
+    fields = [field.strip() for field in fields.split(",")] if fields else list(const.col_flat_to_rent)
+    query = listings_query(fields,
+                           postcode,
+                           property_type,
+                           number_of_bedroom,
+                           min_price,
+                           max_price,
+                           station,
+                           cursor)
+
+    # ndjson streams every matching row after the cursor in constant memory
+    if format == "ndjson":
+        return StreamingResponse(stream_ndjson(query), media_type="application/x-ndjson")
+
+    rows = database.execute(query.limit(limit + 1)).all()
+    listings = [row._asdict() for row in rows[:limit]]
+    next_cursor = encode_cursor(listings[-1]["unique_id"]) if len(rows) > limit else None
+    return {"listings": listings, "next_cursor": next_cursor}
+
+
+def parse_numbers(name: str, value: str):
+    if value is None:
+        return None
+    try:
+        return [float(item) for item in value.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be a comma-separated list of numbers")
+
+
+@rent_app.get("/rent/ranked")
+def get_ranked(database: Session = Depends(get_db),
+               price_weight: float = None,
+               confort_weight: float = None,
+               transport_weight: float = None,
+               transport_bins: str = None,
+               transport_levels: str = None,
+               missing_transport_score: float = None,
+               destinations: str = None,
+               postcode: str = None,
+               limit: int = Query(20, ge=1, le=500)):
+    # rank with a custom profile without touching the shared scores table
+    try:
+        profile = make_profile(price_weight=price_weight,
+                               confort_weight=confort_weight,
+                               transport_weight=transport_weight,
+                               transport_bins=parse_numbers("transport_bins", transport_bins),
+                               transport_levels=parse_numbers("transport_levels", transport_levels),
+                               missing_transport_score=missing_transport_score)
+        # NaPTAN ids, commute time is to the closest of them
+        destinations = [code.strip() for code in destinations.split(",")] if destinations else None
+        ranked = ranker.rank(profile, postcode, limit, destinations)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    table = db.FlatsToRent.__table__
+    details = {row.unique_id: row._asdict() for row in
+               database.execute(select(table.c.unique_id,
+                                       table.c.postcode,
+                                       table.c.property_type,
+                                       table.c.address,
+                                       table.c.price,
+                                       table.c.number_of_bedroom,
+                                       table.c.number_of_bathroom,
+                                       table.c.nearest_station,
+                                       table.c.link)
+                                .where(table.c.unique_id.in_(ranked["unique_id"].tolist())))}
+    listings = [{**details.get(row["unique_id"], {"unique_id": row["unique_id"]}), **row}
+                for row in ranked.astype(object).where(ranked.notna(), None).to_dict(orient="records")]
+    return {"profile": profile, "destinations": destinations, "listings": listings}
+
+
+@rent_app.get("/rent/destinations")
+def get_destinations():
+    destinations = db.get_destinations()
+    return {"destinations": destinations.to_dict(orient="records")}
+
+
+def property_type_filter(property_type: str):
+    # match the "Apartment/Flat" merge without wrapping the indexed column in an expression
+    if property_type == "Apartment/Flat":
+        return db.FlatsToRent.property_type.in_(MERGED_PROPERTY_TYPES)
+    return and_(db.FlatsToRent.property_type == property_type,
+                db.FlatsToRent.property_type.notin_(MERGED_PROPERTY_TYPES))
+
+
 @rent_app.get("/rent/stats")
 async def get_stat(database: Session = Depends(get_db),
                    postcode: str = None,
                    property_type: str = None,
                    number_of_bedroom: int = None,
                    number_of_bathroom: int = None):
-    
-    data = database.query(db.FlatsToRent).all()
-    df = pd.DataFrame([r.__dict__ for r in data])
-    if df.empty:
-        logger.warning("No data found for the given condition(s)")
-        return {"message": "No data found for the given condition(s)"}
-    else:
-        df["property_type"] = np.where(df["property_type"].isin(["Apartment", "Flat"]),
-                                         "Apartment/Flat",
-                                         df["property_type"])
-    
-    stats = df.groupby(["postcode",
-                              "property_type",
-                              "number_of_bedroom",
-                              "number_of_bathroom"])["price"].agg(['mean', 'count', 'min', 'max']).reset_index()
-    
+    merged_property_type = case((db.FlatsToRent.property_type.in_(MERGED_PROPERTY_TYPES), "Apartment/Flat"),
+                                else_=db.FlatsToRent.property_type).label("property_type")
+    group_columns = [db.FlatsToRent.postcode,
+                     merged_property_type,
+                     db.FlatsToRent.number_of_bedroom,
+                     db.FlatsToRent.number_of_bathroom]
+    query = database.query(*group_columns,
+                           func.avg(db.FlatsToRent.price).label("mean"),
+                           func.count(db.FlatsToRent.price).label("count"),
+                           func.min(db.FlatsToRent.price).label("min"),
+                           func.max(db.FlatsToRent.price).label("max"))\
+                    .filter(db.FlatsToRent.property_type.isnot(None),
+                            db.FlatsToRent.number_of_bedroom.isnot(None),
+                            db.FlatsToRent.number_of_bathroom.isnot(None))
+
     if postcode is not None:
-        stats = stats[stats["postcode"] == postcode]
+        query = query.filter(db.FlatsToRent.postcode == postcode)
 
     if property_type is not None:
-        stats = stats[stats["property_type"] == property_type]
+        query = query.filter(property_type_filter(property_type))
 
     if number_of_bedroom is not None:
-        stats = stats[stats["number_of_bedroom"] == number_of_bedroom]
+        query = query.filter(db.FlatsToRent.number_of_bedroom == number_of_bedroom)
 
     if number_of_bathroom is not None:
-        stats = stats[stats["number_of_bathroom"] == number_of_bathroom]
+        query = query.filter(db.FlatsToRent.number_of_bathroom == number_of_bathroom)
+
+    stats = query.group_by(*group_columns).order_by(*group_columns).all()
+    # as before the rewrite: the message only when nothing is stored at all,
+    # a filter matching nothing gives an empty list
+    if not stats and database.query(db.FlatsToRent.unique_id).first() is None:
+        logger.warning("No data found for the given condition(s)")
+        return {"message": "No data found for the given condition(s)"}
 
     # Convert to dictionary for JSON response
-    stats_dict = stats.to_dict(orient='records')
+    stats_dict = [row._asdict() for row in stats]
     return {"statistics": stats_dict}
 
         
@@ -132,11 +307,14 @@ async def delete_rentals(
             else:
                 query = query.filter(db.FlatsToRent.property_type == property_type)
         
-        # Get count before deletion for reporting
+        # Get count and touched postcodes before deletion for reporting
         count = query.count()
+        postcodes = [row.postcode for row in query.with_entities(db.FlatsToRent.postcode).distinct()]
         
-        # Perform deletion
+        # Perform deletion, keeping the summary table in the same transaction
         query.delete(synchronize_session=False)
+        db.refresh_postcode_stats(database.connection(), postcodes)
+        db.bump_data_version(database.connection(), "listings")
         database.commit()
         
         return {"message": f"Successfully deleted {count} records",
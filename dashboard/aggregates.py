@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from dashboard.data import load_listings
+
+PRICE_COLUMN = "price_per_room"
+PRICE_BINS = 40
+SCORE_BINS = 20
+SCORE_COLUMNS = {"Combined Score": "combined_score",
+                 "Price Score": "price_score",
+                 "Comfort Score": "confort_score",
+                 "Transport Score": "transport_score"}
+
+
+def grouped_histograms(values, groups, edges):
+    """Histogram of `values` per group code in one bincount pass.
+
+    `groups` are integer codes (-1 for no group), `edges` are shared by
+    every group. Returns a groups x bins count matrix, NaN values and
+    values outside the edges are not counted (as np.histogram).
+    """
+    n_groups = int(groups.max()) + 1 if len(groups) else 0
+    n_bins = len(edges) - 1
+    # right-open bins except the last one, which includes the upper edge
+    bins = np.searchsorted(edges, values, side="right") - 1
+    bins[values == edges[-1]] = n_bins - 1
+    valid = (groups >= 0) & (bins >= 0) & (bins < n_bins) & np.isfinite(values)
+    counts = np.bincount(groups[valid] * n_bins + bins[valid], minlength=n_groups * n_bins)
+    return counts.reshape(n_groups, n_bins)
+
+
+def price_histograms_of(df, column=PRICE_COLUMN, n_bins=PRICE_BINS):
+    values = df[column].to_numpy(dtype=float)
+    postcodes = pd.Categorical(df["postcode"])
+    groups = postcodes.codes.astype(np.int64)
+    finite = np.isfinite(values)
+    if finite.any():
+        edges = np.linspace(np.floor(values[finite].min()), np.ceil(values[finite].max()), n_bins + 1)
+    else:
+        edges = np.linspace(0, 1, n_bins + 1)
+    n_groups = len(postcodes.categories)
+    known = finite & (groups >= 0)
+    sums = np.bincount(groups[known], weights=values[known], minlength=n_groups)
+    priced = np.bincount(groups[known], minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / priced
+    return {"postcodes": list(postcodes.categories),
+            "edges": edges,
+            "counts": grouped_histograms(values, groups, edges),
+            "means": means,
+            "sizes": np.bincount(groups[groups >= 0], minlength=n_groups)}
+
+
+def room_pivots_of(df, column=PRICE_COLUMN):
+    # count and mean per bedroom x bathroom cell from a single groupby
+    stats = df.groupby(["number_of_bedroom", "number_of_bathroom"])[column].agg(["count", "mean"])
+    count_pivot = stats["count"].unstack(fill_value=0).fillna(0).astype(int).sort_index(ascending=False)
+    mean_pivot = stats["mean"].unstack(fill_value=0).fillna(0).sort_index(ascending=False)
+    return count_pivot, mean_pivot
+
+
+def score_histograms_of(df, columns=SCORE_COLUMNS, n_bins=SCORE_BINS):
+    histograms = {}
+    for name, column in columns.items():
+        values = df[column].to_numpy(dtype=float)
+        values = values[np.isfinite(values)]
+        counts, edges = np.histogram(values, bins=n_bins)
+        histograms[name] = {"counts": counts,
+                            "edges": edges,
+                            "mean": values.mean() if len(values) else np.nan}
+    return histograms
+
+
+# cached per data version and filter state, the dataframes themselves
+# come from the load_listings cache
+@st.cache_data(max_entries=16, show_spinner=False)
+def price_histograms(version, filters=None):
+    return price_histograms_of(load_listings(version, filters))
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def room_pivots(version, filters=None):
+    return room_pivots_of(load_listings(version, filters))
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def score_histograms(version, filters=None):
+    return score_histograms_of(load_listings(version, filters))
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from sqlalchemy import func, select
+from src.database import db
+import src.const as const
+
+# datasets the dashboard reads, their versions are bumped by ingest and scoring
+DATASETS = ("listings", "scores")
+
+
+def data_version():
+    # one primary key lookup per rerun, the cached queries below are keyed on it
+    return db.get_data_version(*DATASETS)
+
+
+# long text only fetched for the row being looked at
+DETAIL_COLUMNS = ["description"]
+TABLE_COLUMNS = [col for col in const.col_flat_to_rent if col not in DETAIL_COLUMNS] + const.col_scores[1:]
+
+
+def apply_filters(query, filters=None):
+    flats = db.FlatsToRent.__table__
+    filters = filters or {}
+    # every filter is a bound parameter on an indexed flats_to_rent column
+    if filters.get("postcode"):
+        query = query.where(flats.c.postcode.in_(filters["postcode"]))
+    if filters.get("property_type"):
+        query = query.where(flats.c.property_type.in_(filters["property_type"]))
+    if filters.get("nearest_station"):
+        query = query.where(flats.c.nearest_station.in_(filters["nearest_station"]))
+    if filters.get("price") is not None:
+        query = query.where(flats.c.price.between(*filters["price"]))
+    if filters.get("num_image") is not None:
+        query = query.where(flats.c.num_image.between(*filters["num_image"]))
+    return query
+
+
+def listings_query(filters=None, columns=TABLE_COLUMNS):
+    flats = db.FlatsToRent.__table__
+    scores = db.Score.__table__
+    query = (select(*[scores.c[col] if col in const.col_scores[1:] else flats.c[col] for col in columns])
+             .select_from(flats.outerjoin(scores, scores.c.unique_id == flats.c.unique_id)))
+    return apply_filters(query, filters)
+
+
+def add_price_per_room(df):
+    df["price"] = df["price"].astype(float)
+    df["price_per_room"] = np.where(df["number_of_bedroom"].isna(),
+                                    df["price"],
+                                    df["price"] / df["number_of_bedroom"])
+    return df
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_listings(version, filters=None):
+    """Listings joined with their scores, `filters` applied in SQL.
+
+    `version` is only part of the cache key, so the query runs again
+    once ingest or scoring wrote new data.
+    """
+    with db.engine.connect() as conn:
+        result = conn.execute(listings_query(filters))
+        df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+    return add_price_per_room(df)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def count_listings(version, filters=None):
+    flats = db.FlatsToRent.__table__
+    with db.engine.connect() as conn:
+        return conn.execute(apply_filters(select(func.count()).select_from(flats), filters)).scalar()
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def load_page(version, filters=None, sort="combined_score", ascending=False, page=0, page_size=50):
+    """One page of the filtered listings, sorted in SQL with LIMIT/OFFSET."""
+    if sort not in TABLE_COLUMNS:
+        raise ValueError(f"Cannot sort by {sort}")
+    column = listings_query(columns=[sort]).selected_columns[0]
+    order = column.asc() if ascending else column.desc()
+    # unique_id breaks ties so pages don't overlap
+    query = (listings_query(filters)
+             .order_by(order.nulls_last(), db.FlatsToRent.unique_id)
+             .limit(page_size)
+             .offset(page * page_size))
+    with db.engine.connect() as conn:
+        result = conn.execute(query)
+        df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+    return add_price_per_room(df)
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_details(version, unique_id):
+    flats = db.FlatsToRent.__table__
+    with db.engine.connect() as conn:
+        row = conn.execute(select(*[flats.c[col] for col in DETAIL_COLUMNS])
+                           .where(flats.c.unique_id == unique_id)).mappings().first()
+    return dict(row) if row is not None else {}
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def filter_options(version):
+    flats = db.FlatsToRent.__table__
+    with db.engine.connect() as conn:
+        def distinct(column):
+            return [value for (value,) in conn.execute(select(column).distinct().order_by(column))
+                    if value is not None]
+
+        price_min, price_max, num_image_max = conn.execute(select(func.min(flats.c.price),
+                                                                  func.max(flats.c.price),
+                                                                  func.max(flats.c.num_image))).one()
+        return {"postcode": distinct(flats.c.postcode),
+                "property_type": distinct(flats.c.property_type),
+                "nearest_station": distinct(flats.c.nearest_station),
+                "price": (float(price_min or 0), float(price_max or 0)),
+                "num_image": float(num_image_max or 0)}
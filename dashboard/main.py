@@ -5,37 +5,33 @@ import seaborn as sns
 import numpy as np
 import warnings
 import streamlit.components.v1 as components
-from dashboard.utils import load_data, score_dist, price_dist, create_heatmap_data, london_heatmap
+from dashboard.data import TABLE_COLUMNS, count_listings, data_version, filter_options, load_details, load_listings, load_page
+from dashboard.aggregates import price_histograms, room_pivots, score_histograms
+from dashboard.utils import score_dist, price_dist, london_heatmap, style_page
 warnings.filterwarnings('ignore') # To supress warnings
 sns.set(style="darkgrid") # set the background for the graphs
 
-df = load_data()
-df.tail(25).to_excel("/Users/sqwu/Downloads/sample_data.xlsx")
-df["price_per_room"] = np.where(df["number_of_bedroom"].isna(),
-                                df["price"],
-                                df["price"]/df["number_of_bedroom"])
+version = data_version()
+options = filter_options(version)
 
 # Dashboard UI
 st.title("🏠 Property Rental Dashboard")
 st.sidebar.header("Filters")
 
 # Filters
-location_filter = st.sidebar.multiselect("Postcode", df['postcode'].unique())
-property_type_filter = st.sidebar.multiselect("Property type", df['property_type'].unique())
-# num_img_filter = st.sidebar.multiselect("Number of images", df['num_image'].unique())
-station_filter = st.sidebar.multiselect("Nearest station", df['nearest_station'].unique())
-price_range = st.sidebar.slider("Price Range (£)", float(df['price'].min()), float(df['price'].max()), (650.0, 6000.0))
-num_img_range = st.sidebar.slider("Number of images range", 0.0, float(df['num_image'].max()), (0.0, float(df['num_image'].max())))
-
-# Filter data
-filtered_df = df[
-    (df['postcode'].isin(location_filter) if location_filter else True) &
-    (df['property_type'].isin(property_type_filter) if property_type_filter else True) &
-    # (df['num_image'].isin(num_img_filter) if num_img_filter else True) &
-    (df['nearest_station'].isin(station_filter) if station_filter else True) &
-    (df['price'].between(price_range[0], price_range[1])) &
-    (df['num_image'].astype(float).between(num_img_range[0], num_img_range[1]))
-]
+location_filter = st.sidebar.multiselect("Postcode", options['postcode'])
+property_type_filter = st.sidebar.multiselect("Property type", options['property_type'])
+station_filter = st.sidebar.multiselect("Nearest station", options['nearest_station'])
+price_range = st.sidebar.slider("Price Range (£)", options['price'][0], options['price'][1], (650.0, 6000.0))
+num_img_range = st.sidebar.slider("Number of images range", 0.0, options['num_image'], (0.0, options['num_image']))
+
+# Filter data in SQL, cached per filter state and data version
+filters = {"postcode": location_filter,
+           "property_type": property_type_filter,
+           "nearest_station": station_filter,
+           "price": price_range,
+           "num_image": num_img_range}
+filtered_df = load_listings(version, filters)
 
 #---------------------------------------------------------------------#
 # Key Metrics
@@ -47,22 +43,21 @@ st.metric("Average Price (£) per room", f"{filtered_df['price_per_room'].mean()
 #---------------------------------------------------------------------#
 # Create London appartment heatmap
 #---------------------------------------------------------------------#
-london_heatmap(filtered_df)
-components.html(open("map.html", 'r').read(), height=600)
+# rendered in memory, each session gets its own map
+components.html(london_heatmap(filtered_df).get_root().render(), height=600)
 
 #---------------------------------------------------------------------#
 # Price distribution by location
 #---------------------------------------------------------------------#
 st.header("Price (per room) distribution by location")
 
-postcode_list = df['postcode'].unique()
-num_loc = len(postcode_list)
-fig, ax_list = plt.subplots(num_loc, 1, figsize=(10, num_loc*3.4), dpi=100)
+# every postcode histogrammed on shared bins in one pass
+histograms = price_histograms(version)
+num_loc = len(histograms["postcodes"])
+fig, ax_list = plt.subplots(num_loc, 1, figsize=(10, num_loc*3.4), dpi=100, squeeze=False)
 
 for i in range(num_loc):
-    pc = postcode_list[i]
-    ax = ax_list[i]
-    price_dist(df, pc, fig, ax)
+    price_dist(histograms, i, ax_list[i, 0])
 plt.tight_layout(pad=2.0)
 st.pyplot(plt.gcf())
 
@@ -72,7 +67,7 @@ st.pyplot(plt.gcf())
 st.header("Price Heatmap (Bedrooms × Bathrooms)")
 
 # Generate data
-count_pivot, price_pivot = create_heatmap_data(df)
+count_pivot, price_pivot = room_pivots(version)
 
 # Create the heatmap
 plt.figure(figsize=(10, 6))
@@ -98,11 +93,29 @@ st.pyplot(plt.gcf())
 # Histogram of scores
 #---------------------------------------------------------------------#
 st.header("Score distribution")
-score_dist(filtered_df)
+score_dist(score_histograms(version, filters))
 st.pyplot(plt.gcf())
 
 #---------------------------------------------------------------------#
 # Data Table
 #---------------------------------------------------------------------#
 st.header("Data")
-st.dataframe(filtered_df.style.background_gradient(cmap='Blues'))
\ No newline at end of file
+sort_col, order_col, size_col = st.columns(3)
+sort = sort_col.selectbox("Sort by", TABLE_COLUMNS, index=TABLE_COLUMNS.index("combined_score"))
+ascending = order_col.checkbox("Ascending", value=False)
+page_size = size_col.selectbox("Rows per page", [25, 50, 100], index=1)
+num_pages = max(1, -(-count_listings(version, filters) // page_size))
+page = st.number_input(f"Page (of {num_pages})", min_value=1, max_value=num_pages, value=1) - 1
+
+# only the visible page is queried and styled
+page_df = load_page(version, filters, sort, ascending, page, page_size)
+event = st.dataframe(style_page(page_df, filtered_df),
+                     hide_index=True,
+                     on_select="rerun",
+                     selection_mode="single-row")
+
+# long text is fetched for the selected row only
+for row in event.selection.rows:
+    listing = page_df.iloc[row]
+    with st.expander(f"{listing['address']} ({listing['unique_id']})", expanded=True):
+        st.write(load_details(version, listing['unique_id']).get("description"))
\ No newline at end of file
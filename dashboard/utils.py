@@ -1,64 +1,91 @@
+import functools
+import json
+import os
+import threading
 import pandas as pd
-from src.database import db
 import folium
-import geopandas as gpd
 from folium.plugins import HeatMap
 import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
 import warnings
-from sqlalchemy import text
-from src.database.db import engine
-import src.const as const
 warnings.filterwarnings('ignore') # To supress warnings
 sns.set(style="darkgrid") # set the background for the graphs
 
-def load_data():
-    # Example: Fetch from SQLite, CSV, or API
-    # database = db.SessionLocal()
-    # data = database.query(db.FlatsToRent).all()
-    # df = pd.DataFrame([task.__dict__ for task in data])
-    # df = df.drop(columns=["_sa_instance_state"], axis=1)
-
-    with engine.begin() as conn:
-        try:
-            result_flats = conn.execute(text("SELECT * FROM flats_to_rent"))
-            df_flats = pd.DataFrame(data=result_flats, columns=const.col_flat_to_rent)
-            result_scores = conn.execute(text("SELECT * FROM scores;"))
-            df_scores = pd.DataFrame(data=result_scores, columns=const.col_scores)
-            # combine data
-            df = pd.merge(df_flats,
-                          df_scores,
-                          on="unique_id",
-                          how="left")
-        except Exception as e:
-            raise e
-        finally:
-            conn.close()
-    return df
+POSTCODE_GEOJSON = "./files/london_postcodes.json"
+# simplified boundaries with centroids, rebuilt when the source file changes
+POSTCODE_GEOMETRY_CACHE = "./files/output/london_postcodes_simplified.json"
+SIMPLIFY_TOLERANCE = 0.0002  # degrees, roughly 15-20 m in London
+
+def round_coordinates(coords, ndigits=5):
+    if isinstance(coords[0], (int, float)):
+        return [round(value, ndigits) for value in coords]
+    return [round_coordinates(part, ndigits) for part in coords]
+
+
+def build_postcode_geometry(source=POSTCODE_GEOJSON,
+                            target=POSTCODE_GEOMETRY_CACHE,
+                            tolerance=SIMPLIFY_TOLERANCE):
+    from shapely.geometry import mapping, shape
+
+    with open(source) as f:
+        raw = json.load(f)
+    features = []
+    for feature in raw["features"]:
+        geometry = shape(feature["geometry"])
+        valid = not geometry.is_empty and geometry.is_valid
+        centroid = geometry.centroid if valid else None
+        simplified = mapping(geometry.simplify(tolerance, preserve_topology=True))
+        features.append({"type": "Feature",
+                         "geometry": {"type": simplified["type"],
+                                      "coordinates": round_coordinates(simplified["coordinates"])},
+                         "properties": {"postcode": feature["properties"]["Name"].upper().strip(),
+                                        "lat": round(centroid.y, 6) if valid else None,
+                                        "lon": round(centroid.x, 6) if valid else None}})
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # written aside and swapped in, sessions building it at once never see a partial file
+    temp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f, separators=(",", ":"))
+    os.replace(temp, target)
+
+
+@functools.lru_cache(maxsize=1)
+def load_postcode_geometry():
+    # parsed once per process, and simplified once per source file
+    if not os.path.exists(POSTCODE_GEOMETRY_CACHE) or \
+            os.path.getmtime(POSTCODE_GEOMETRY_CACHE) < os.path.getmtime(POSTCODE_GEOJSON):
+        build_postcode_geometry()
+    with open(POSTCODE_GEOMETRY_CACHE) as f:
+        geometry = json.load(f)
+    # upper-cased postcode of every feature, a few districts have more than one polygon
+    keys = pd.Index([feature["properties"]["postcode"] for feature in geometry["features"]])
+    return geometry, keys
+
+
+def postcode_counts(df):
+    # apartments per postcode, aligned with the cached geometry
+    _, keys = load_postcode_geometry()
+    counts = df["postcode"].dropna().str.upper().str.strip().value_counts()
+    return counts.reindex(keys, fill_value=0).to_numpy(dtype=int)
 
 
 def london_heatmap(df):
-    # Load your GeoJSON or shapefile
-    geo_df = gpd.read_file("./files/london_postcodes.json")
-
-    # Calculate apartments per postcode
-    df_count_per_postcode = df.groupby(["postcode"])[["property_type"]].count().reset_index()
-    df_count_per_postcode.columns = ["postcode", "count"]
-
-    # Merge with apartment counts
-    geo_df['postcode'] = geo_df['Name'].str.upper().str.strip()
-    df_count_per_postcode['postcode'] = df_count_per_postcode['postcode'].str.upper().str.strip()
-    merged = geo_df.merge(df_count_per_postcode, on='postcode', how='left')
-    merged['count'] = merged['count'].fillna(0).astype(int)
+    geometry, keys = load_postcode_geometry()
+    counts = postcode_counts(df)
+    # only the count is joined on, the cached features are never modified
+    features = [{**feature, "properties": {**feature["properties"], "count": int(count)}}
+                for feature, count in zip(geometry["features"], counts)]
+    layer = {"type": "FeatureCollection", "features": features}
+    df_count_per_postcode = pd.DataFrame({"postcode": keys, "count": counts}).drop_duplicates("postcode")
 
     # Create base map
     m = folium.Map(location=[51.509865, -0.118092], zoom_start=12, tiles='cartodbpositron')
 
     # Add choropleth layer
     folium.Choropleth(
-        geo_data=merged,
-        data=merged,
+        geo_data=layer,
+        data=df_count_per_postcode,
         columns=['postcode', 'count'],
         key_on='feature.properties.postcode',
         fill_color='YlOrRd',
@@ -67,17 +94,17 @@ def london_heatmap(df):
         legend_name='Number of Apartments',
     ).add_to(m)
 
-    # Add postcode labels (postcode + count) at polygon centroid
-    for _, row in merged.iterrows():
-        if row['geometry'].is_empty or not row['geometry'].is_valid:
+    # Add postcode labels (postcode + count) at the precomputed centroids
+    for feature in features:
+        properties = feature["properties"]
+        if properties["lat"] is None:
             continue
-        centroid = row['geometry'].centroid
-        if int(row['count']) > 0:
-            popup_text = f"{row['postcode']}: {int(row['count'])}"
+        if properties["count"] > 0:
+            popup_text = f"{properties['postcode']}: {properties['count']}"
         else:
-            popup_text = f"{row['postcode']}"
+            popup_text = f"{properties['postcode']}"
         folium.Marker(
-            location=[centroid.y, centroid.x],
+            location=[properties["lat"], properties["lon"]],
             icon=folium.DivIcon(
                 html=f"""<div style="font-size:10px; color:#000000; text-align:center;">{popup_text}</div>"""
             )
@@ -85,7 +112,7 @@ def london_heatmap(df):
 
     # Optional: Hover tooltip on each zone
     folium.GeoJson(
-        merged,
+        layer,
         name="Postcodes",
         style_function=lambda x: {
             "fillOpacity": 0,
@@ -98,9 +125,6 @@ def london_heatmap(df):
         )
     ).add_to(m)
 
-    # Save to HTML
-    m.save("map.html")
-
     return m
 
 
@@ -141,46 +165,16 @@ def london_heatmap(df):
 
 #     return
 
-def create_heatmap_data(df):
-    price = 'price_per_room'
-    """Generate two pivot tables: counts and avg prices"""
-    count_pivot = df.pivot_table(
-        index='number_of_bedroom',
-        columns='number_of_bathroom',
-        values=price,
-        aggfunc='count',
-        fill_value=0
-    ).sort_index(ascending=False)
-    
-    price_pivot = df.pivot_table(
-        index='number_of_bedroom',
-        columns='number_of_bathroom',
-        values=price,
-        aggfunc='mean',
-        fill_value=0
-    ).sort_index(ascending=False)
-    
-    return count_pivot, price_pivot
-
-def price_dist(df, zone, fig, ax):
-    price = 'price_per_room'
-    df_plot = df[df['postcode'] == zone]
-    mean = df_plot[price].mean()
-    min = int(df[price].max())
-    max = int(df[price].min())
-    
-    # Define your fixed range
-    PRICE_RANGE = [max, min]
-    N_BINS = 40  # Adjust bin count as needed
-    
-    # Create bins equally spaced across the fixed range
-    bins = np.linspace(max, min, N_BINS+1)
-    
-    # Plot histogram with fixed bins
-    ax.hist(df_plot[price], bins=bins, color='#FF4B4B', alpha=0.5)
+def price_dist(histograms, i, ax):
+    zone = histograms["postcodes"][i]
+    edges = histograms["edges"]
+    mean = histograms["means"][i]
+
+    # Plot the precomputed counts on the shared bins
+    ax.hist(edges[:-1], bins=edges, weights=histograms["counts"][i], color='#FF4B4B', alpha=0.5)
     
     # Force x-axis limits
-    ax.set_xlim(PRICE_RANGE)
+    ax.set_xlim([edges[0], edges[-1]])
     
     # Add mean line and label
     ax.axvline(mean, color='green', linestyle='--')
@@ -190,23 +184,15 @@ def price_dist(df, zone, fig, ax):
     # Labels and title
     ax.set_xlabel('Monthly Rent (£)')
     ax.set_ylabel('Number of Properties')
-    ax.set_title(f'Price distribution of {zone} (n={len(df_plot)})', fontsize=12, pad=10)
+    ax.set_title(f'Price distribution of {zone} (n={histograms["sizes"][i]})', fontsize=12, pad=10)
     
     # Add grid and clean up borders
     ax.grid(axis='y', alpha=0.3)
 
 
-def score_dist(df):
+def score_dist(histograms):
     fig, (ax1, ax2, ax3, ax4) = plt.subplots(4, 1, figsize=(10, 10), dpi=100)
 
-    # Data to plot
-    scores = {
-        'Combined Score': df['combined_score'],
-        'Price Score': df['price_score'],
-        'Comfort Score': df['confort_score'],
-        'Transport Score': df['transport_score'],
-    }
-
     colors = {
         'Combined Score': '#FF4B4B',
         'Price Score': '#4BFF4B',
@@ -215,12 +201,13 @@ def score_dist(df):
     }
 
     # Plot each histogram in its own subplot
-    for ax, (name, data) in zip([ax1, ax2, ax3, ax4], scores.items()):
-        # Plot histogram
-        ax.hist(data, bins=20, color=colors[name], alpha=0.7, label=name)
+    for ax, (name, histogram) in zip([ax1, ax2, ax3, ax4], histograms.items()):
+        # Plot the precomputed histogram
+        edges = histogram["edges"]
+        ax.hist(edges[:-1], bins=edges, weights=histogram["counts"], color=colors[name], alpha=0.7, label=name)
 
         # Add mean line and text
-        mean = data.mean()
+        mean = histogram["mean"]
         ax.axvline(mean, color=colors[name], linestyle='--', linewidth=1.5, alpha=0.8)
         ax.text(mean, ax.get_ylim()[1]*0.9, f'Mean: {mean:.2f}',
                 color=colors[name], ha='center', fontsize=10, bbox=dict(facecolor='white', alpha=0.7))
@@ -239,4 +226,14 @@ def score_dist(df):
         ax.legend()
 
     # Adjust layout and spacing
-    plt.tight_layout(pad=2.0)
\ No newline at end of file
+    plt.tight_layout(pad=2.0)
+
+
+def style_page(page_df, df):
+    # same per-column gradient as styling the whole filtered frame,
+    # with the colour range taken from `df` so pages stay comparable
+    styler = page_df.style
+    for col in page_df.select_dtypes("number").columns:
+        low, high = (df[col].min(), df[col].max()) if col in df else (None, None)
+        styler = styler.background_gradient(cmap='Blues', subset=[col], vmin=low, vmax=high)
+    return styler
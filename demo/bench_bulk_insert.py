@@ -0,0 +1,58 @@
+# Compare the old ORM insert path (iterrows + bulk_save_objects) with
+# db.bulk_write on a throwaway sqlite file.
+# Run from the repo root: python -m demo.bench_bulk_insert
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from src.database.db import Base, Score, bulk_write
+
+N_ROWS = 100_000
+
+
+def make_scores(n):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({"unique_id": [f"5E749{i}|1|2025-07-19" for i in range(n)],
+                         "price_score": rng.random(n) * 10,
+                         "confort_score": rng.random(n) * 10,
+                         "transport_score": rng.choice([10, 8, 6, 3.5, 1.5], n),
+                         "combined_score": rng.random(n) * 10})
+
+
+def orm_insert(engine, df):
+    session = sessionmaker(bind=engine)()
+    scores = []
+    for _, row in df.iterrows():
+        scores.append(Score(unique_id=row["unique_id"],
+                            price_score=row["price_score"],
+                            confort_score=row["confort_score"],
+                            transport_score=row["transport_score"],
+                            combined_score=row["combined_score"]))
+    session.bulk_save_objects(scores)
+    session.commit()
+    session.close()
+
+
+def core_insert(engine, df):
+    with engine.begin() as conn:
+        bulk_write(Score.__table__, df, conn)
+
+
+def bench(name, insert, df):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        start = time.perf_counter()
+        insert(engine, df)
+        elapsed = time.perf_counter() - start
+        engine.dispose()
+    print(f"{name:<28} {elapsed:7.2f}s  {len(df) / elapsed:10,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    df = make_scores(N_ROWS)
+    bench("iterrows + bulk_save_objects", orm_insert, df)
+    bench("bulk_write (upsert)", core_insert, df)
@@ -0,0 +1,80 @@
+# Compare the previous pandas scoring (casts written back into the frame,
+# nested np.where ladders) with the array kernel behind combined_score.
+# Run from the repo root: python -m demo.bench_scoring
+import time
+import numpy as np
+import pandas as pd
+from src import scoring
+
+N_ROWS = 1_000_000
+
+
+def make_flats(n):
+    rng = np.random.default_rng(0)
+    bedroom = rng.integers(0, 5, n).astype(float)
+    bedroom[rng.random(n) < 0.05] = np.nan
+    bathroom = rng.integers(1, 4, n).astype(float)
+    bathroom[rng.random(n) < 0.05] = np.nan
+    travel_time = rng.integers(5, 70, n).astype(float)
+    travel_time[rng.random(n) < 0.1] = np.nan
+    return pd.DataFrame({"price": rng.integers(900, 6000, n).astype(float),
+                         "number_of_bedroom": bedroom,
+                         "number_of_bathroom": bathroom,
+                         "distance_to_station": rng.random(n).round(1),
+                         "travel_time": travel_time,
+                         "walk_time": rng.integers(0, 15, n).astype(float)})
+
+
+def legacy_combined_score(df):
+    df["number_of_bedroom"] = df["number_of_bedroom"].fillna('1').astype(int)
+    df["number_of_bathroom"] = df["number_of_bathroom"].fillna('1').astype(int)
+    df["price"] = df["price"].astype(float)
+    df["price_score"] = np.where(df["number_of_bathroom"] == 1,
+                                 (df["number_of_bedroom"] + df["number_of_bathroom"]/3)/df["price"],
+                                 (df["number_of_bedroom"] + (df["number_of_bathroom"]-1)/3)/df["price"])
+    scores = df["price_score"].astype(float)
+    df["price_score"] = 5 * np.tanh((scores - scores.mean()) / (scores.std() * 2)) + 5
+    df["confort_score"] = np.where(df["number_of_bathroom"] == 1,
+                                   df["number_of_bathroom"]/df["number_of_bedroom"],
+                                   (df["number_of_bathroom"] - 1)/(df["number_of_bedroom"] - 1))
+    df["confort_score"] = np.minimum(df["confort_score"] * 10, 10)
+    df["total_trans_tm"] = df["distance_to_station"] * 20 + df["travel_time"] + df["walk_time"]
+    df["transport_score"] = np.where(df["total_trans_tm"].notna(),
+                                     np.where(df["total_trans_tm"]<=20, 10,
+                                              np.where(df["total_trans_tm"]<=30, 8,
+                                                       np.where(df["total_trans_tm"]<=45, 6,
+                                                                np.where(df["total_trans_tm"]<=60, 3.5, 1.5)))),
+                                                                2)
+    df["combined_score"] = df["price_score"] * df["confort_score"] * df["transport_score"] / 100
+    return df
+
+
+def kernel_only(df):
+    # arrays extracted once, as a caller holding columnar data would
+    arrays = [scoring.as_array(df, col) for col in ["price", "number_of_bedroom", "number_of_bathroom",
+                                                    "distance_to_station", "travel_time", "walk_time"]]
+    start = time.perf_counter()
+    scores = scoring.score_kernel(*arrays)
+    return scores, time.perf_counter() - start
+
+
+def bench(name, score, df):
+    start = time.perf_counter()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = score(df.copy())
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {elapsed:7.3f}s  {len(df) / elapsed:12,.0f} rows/s")
+    return result
+
+
+if __name__ == "__main__":
+    df = make_flats(N_ROWS)
+    legacy = bench("pandas (previous)", legacy_combined_score, df)
+    current = bench("combined_score (kernel)", lambda df: scoring.combined_score(
+        df, "price", "number_of_bedroom", "number_of_bathroom"), df)
+    _, elapsed = kernel_only(df)
+    print(f"{'score_kernel (arrays only)':<28} {elapsed:7.3f}s  {len(df) / elapsed:12,.0f} rows/s")
+
+    for col in ["price_score", "confort_score", "transport_score", "combined_score"]:
+        np.testing.assert_allclose(current[col].to_numpy(), legacy[col].to_numpy(), rtol=1e-12, equal_nan=True)
+    print("✅ Scores match the previous implementation.")
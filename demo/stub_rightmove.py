@@ -0,0 +1,124 @@
+# Minimal stand-in for Rightmove search and detail pages, for running the
+# scraper offline. Run from the repo root: python -m demo.stub_rightmove --port 8766
+# then pass base_url="http://127.0.0.1:8766" to src.scrapping.wrapper.
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PAGE_SIZE = 24
+FIRST_PROPERTY_ID = 160000000
+STATIONS = ["Canary Wharf", "Heron Quays", "West India Quay", "South Quay", "Crossharbour"]
+
+
+def property_id(index):
+    return FIRST_PROPERTY_ID + index
+
+
+def listing_card(index):
+    bedrooms = 1 + index % 3
+    return f"""
+    <div class="PropertyCard_propertyCardContainerWrapper__mcK1Z propertyCard-details">
+      <a class="propertyCard-link" href="/properties/{property_id(index)}#/?channel=RES_LET"></a>
+      <div class="PropertyPrice_price__VL65t">£{1500 + 25 * index:,} pcm</div>
+      <span class="PropertyInformation_propertyType__u8e76">Flat</span>
+      <address class="PropertyAddress_address__LYRPq">{index} Stub Street, London</address>
+      <span class="PropertyInformation_bedroomsCount___2b5R">{bedrooms}</span>
+      <div class="PropertyInformation_bathContainer__ut8VY"><span>{1 + index % 2}</span></div>
+      <p class="PropertyCardSummary_summary__oIv57">Stub listing {index} with {bedrooms} bedroom(s).</p>
+      <span class="PropertyDetailsLozenge_imageCount___OS_A"><img aria-label="{5 + index % 10} images"></span>
+    </div>"""
+
+
+def search_page(results, start):
+    cards = "".join(listing_card(index) for index in range(start, min(start + PAGE_SIZE, results)))
+    return f"""<html><body>
+    <div class="ResultsCount_resultsCount__Kqeah"><span>{results:,}</span> results</div>
+    {cards}
+    </body></html>"""
+
+
+def nearest_stations(index):
+    # deterministic per listing, so a test can check what was stored
+    return [{"name": f"{STATIONS[(index + k) % len(STATIONS)]} Station",
+             "distance": round(0.1 + 0.1 * ((index + k) % 7), 1),
+             "unit": "miles"} for k in range(2)]
+
+
+def detail_page(index):
+    model = {"propertyData": {"id": str(property_id(index)), "nearestStations": nearest_stations(index)}}
+    return f"<html><body><script>window.PAGE_MODEL = {json.dumps(model)}</script></body></html>"
+
+
+class StubRightmoveHandler(BaseHTTPRequestHandler):
+    results = 60
+    detail_delay = 0.0
+    lock = threading.Lock()
+    search_requests = 0
+    detail_requests = 0
+    in_flight = 0
+    max_in_flight = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/property-to-rent/find.html":
+            with self.lock:
+                StubRightmoveHandler.search_requests += 1
+            start = int(parse_qs(url.query).get("index", ["0"])[0])
+            self.send_html(search_page(self.results, start))
+        elif url.path.startswith("/properties/"):
+            index = int(url.path.split("/")[2]) - FIRST_PROPERTY_ID
+            if not 0 <= index < self.results:
+                self.send_error(404)
+                return
+            with self.lock:
+                StubRightmoveHandler.detail_requests += 1
+                StubRightmoveHandler.in_flight += 1
+                StubRightmoveHandler.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                # lets concurrent lookups from the worker pool overlap
+                time.sleep(self.detail_delay)
+                html = detail_page(index)
+            finally:
+                # before the response goes out, the client may send its next request right after
+                with self.lock:
+                    StubRightmoveHandler.in_flight -= 1
+            self.send_html(html)
+        else:
+            self.send_error(404)
+
+    def send_html(self, html):
+        body = html.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8766, results=60, detail_delay=0.0):
+    StubRightmoveHandler.results = results
+    StubRightmoveHandler.detail_delay = detail_delay
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubRightmoveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--results", type=int, default=60)
+    parser.add_argument("--detail-delay", type=float, default=0.0)
+    args = parser.parse_args()
+    server = serve(args.port, args.results, args.detail_delay)
+    print(f"Stub Rightmove on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,73 @@
+# Minimal stand-in for the TfL Journey API, for running travel_time offline.
+# Run from the repo root: python -m demo.stub_tfl --port 8765 [--flaky]
+# then: TFL_BASE_URL=http://127.0.0.1:8765 python -m src.travel_time
+import argparse
+import email.utils
+import json
+import re
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+JOURNEY_PATH = re.compile(r"^/Journey/JourneyResults/(?P<from_station>[^/]+)/to/(?P<to_station>[^/?]+)")
+
+
+def stub_duration(from_station, to_station):
+    # deterministic per pair, between 5 and 64 minutes
+    return 5 + zlib.crc32(f"{from_station}-{to_station}".encode()) % 60
+
+
+class StubTfLHandler(BaseHTTPRequestHandler):
+    flaky = False
+    seen = set()
+    requests = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        match = JOURNEY_PATH.match(self.path)
+        if match is None:
+            self.send_error(404)
+            return
+        pair = (match["from_station"], match["to_station"])
+        with self.lock:
+            StubTfLHandler.requests += 1
+            first_attempt = pair not in self.seen
+            self.seen.add(pair)
+        # with --flaky the first request for every pair fails, exercising the retries
+        if self.flaky and first_attempt:
+            # HTTP-date form of Retry-After, already passed so the retry goes out right away
+            self.send_response(503)
+            self.send_header("Retry-After", email.utils.formatdate(usegmt=True))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"journeys": [{"duration": stub_duration(*pair)}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8765, flaky=False):
+    StubTfLHandler.flaky = flaky
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubTfLHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--flaky", action="store_true")
+    args = parser.parse_args()
+    server = serve(args.port, args.flaky)
+    print(f"Stub TfL API on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,70 @@
+# Runs wrapper's pooled fetch path end to end against demo/stub_rightmove.py,
+# in a scratch directory so tasks.db and files/output are not touched.
+# Run from the repo root: python -m demo.test_scrape_pool
+import os
+import tempfile
+import time
+from demo.stub_rightmove import StubRightmoveHandler, nearest_stations, property_id, serve
+
+RESULTS = 60
+WORKERS = 4
+
+
+def run():
+    os.chdir(tempfile.mkdtemp(prefix="stub-scrape-"))
+    from sqlalchemy import text
+    from src.database.db import engine, init_db
+    from src.scrapping import wrapper
+
+    server = serve(port=0, results=RESULTS, detail_delay=0.05)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    init_db()
+
+    start = time.perf_counter()
+    inserted = wrapper("E14", "5E749",
+                       pages=5,
+                       workers=WORKERS,
+                       browser=None,
+                       base_url=base_url,
+                       job_id="stub-run-1")
+    elapsed = time.perf_counter() - start
+    print(f"scraped {inserted} listings in {elapsed:.2f}s, "
+          f"{StubRightmoveHandler.max_in_flight} detail pages fetched at once")
+
+    assert inserted == RESULTS, inserted
+    assert StubRightmoveHandler.detail_requests == RESULTS
+    # the station lookups ran on several pool workers at once
+    assert 1 < StubRightmoveHandler.max_in_flight <= WORKERS
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT unique_id, nearest_station, distance_to_station, "
+                                 "second_nearest_station FROM flats_to_rent")).fetchall()
+        pages = conn.execute(text("SELECT count(*) FROM ingest_checkpoints WHERE job_id = 'stub-run-1'")).scalar()
+    assert len(rows) == RESULTS and pages == 3, (len(rows), pages)
+    for unique_id, station, distance, second_station in rows:
+        index = int(unique_id) - property_id(0)
+        expected = nearest_stations(index)
+        assert (station, second_station) == (expected[0]["name"], expected[1]["name"]), unique_id
+        assert distance == f"{expected[0]['distance']:.1f} miles", unique_id
+    print("✅ Every listing stored with the stations from its detail page.")
+
+    # a rescrape finds every listing unchanged except one whose station
+    # lookup failed, only that detail page is fetched again
+    missing = str(property_id(7))
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE flats_to_rent SET nearest_station = NULL WHERE unique_id = :id"), {"id": missing})
+    detail_requests = StubRightmoveHandler.detail_requests
+    inserted = wrapper("E14", "5E749", pages=5, workers=WORKERS, browser=None,
+                       base_url=base_url, job_id="stub-run-2")
+    with engine.connect() as conn:
+        stored = conn.execute(text("SELECT count(*) FROM flats_to_rent")).scalar()
+        station = conn.execute(text("SELECT nearest_station FROM flats_to_rent WHERE unique_id = :id"),
+                               {"id": missing}).scalar()
+    assert inserted == 1 and StubRightmoveHandler.detail_requests == detail_requests + 1, inserted
+    assert stored == RESULTS, stored
+    assert station == nearest_stations(7)[0]["name"], station
+    print("✅ Rescrape only refetched the listing without stations and stored no duplicates.")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    run()
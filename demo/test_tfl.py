@@ -0,0 +1,37 @@
+# Runs get_journey_times against demo/stub_tfl.py in flaky mode, in a
+# scratch directory so tasks.db is not touched.
+# Run from the repo root: python -m demo.test_tfl
+import os
+import tempfile
+from demo.stub_tfl import StubTfLHandler, serve, stub_duration
+
+STATIONS = ["940GZZLUCYF", "940GZZLUHRQ", "940GZZLUWIQ", "940GZZLUSQU", "940GZZLUCSH"]
+DESTINATIONS = ["940GZZLUBNK", "940GZZLUOXC", "940GZZLUKSX"]
+
+
+def run():
+    os.chdir(tempfile.mkdtemp(prefix="stub-tfl-"))
+    from src.database.db import init_db
+    from src.tfl import get_journey_times
+
+    server = serve(port=0, flaky=True)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    init_db()
+    pairs = [(station, destination) for station in STATIONS for destination in DESTINATIONS]
+
+    durations = get_journey_times(pairs, base_url=base_url)
+    # every pair failed once with a 503 and went through on the retry
+    assert StubTfLHandler.requests == 2 * len(pairs), StubTfLHandler.requests
+    assert durations == {pair: stub_duration(*pair) for pair in pairs}, durations
+    print(f"✅ {len(pairs)} journey times fetched after retrying {len(pairs)} failed requests.")
+
+    # a rerun is served from journey_time_cache
+    requests = StubTfLHandler.requests
+    assert get_journey_times(pairs, base_url=base_url) == durations
+    assert StubTfLHandler.requests == requests, StubTfLHandler.requests - requests
+    print("✅ Rerun served every pair from the cache, no request sent.")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,80 @@
+import datetime
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from .database.db import engine, init_db, get_job_progress
+from .scrapping import wrapper
+
+logger = logging.getLogger(__name__)
+
+
+def ingest_outcode(postcode: str,
+                   loc_code: str,
+                   job_id: str,
+                   **kwargs):
+    start = time.time()
+    inserted_count = wrapper(postcode, loc_code, job_id=job_id, **kwargs)
+    elapsed = time.time() - start
+    return {"postcode": postcode,
+            "listings": inserted_count,
+            "elapsed": round(elapsed, 1),
+            "listings_per_sec": round(inserted_count / elapsed, 2) if elapsed else None}
+
+
+def report_progress(job_id: str, start: float):
+    elapsed = time.time() - start
+    for row in get_job_progress(job_id):
+        print(f"📊 [{job_id}] {row['postcode']}: {row['pages']} page(s), "
+              f"{row['listings']} listings persisted ({elapsed:.0f}s elapsed)")
+
+
+def run_batch(outcodes: list,
+              job_id: str = None,
+              processes: int = 4,
+              progress_interval: float = 30,
+              **kwargs):
+    """Ingest several (postcode, loc_code) pairs across a process pool.
+
+    Every page is checkpointed under `job_id`. Without one, a new job id
+    is made for the run. Pass the job id of a crashed run to resume it,
+    only the pages it had not persisted yet are scraped.
+    Extra keyword arguments are passed through to `wrapper`.
+    """
+    if job_id is None:
+        job_id = f"batch-{datetime.datetime.now():%Y%m%d-%H%M%S}"
+    else:
+        logger.info(f"Batch {job_id}: pages already checkpointed under it are skipped")
+    init_db()
+    # the forked workers must not share the parent's pooled SQLite connection
+    engine.dispose()
+
+    start = time.time()
+    results = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(ingest_outcode, postcode, loc_code, job_id, **kwargs): postcode
+                   for postcode, loc_code in outcodes}
+        not_done = set(futures)
+        while not_done:
+            done, not_done = wait(not_done, timeout=progress_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                postcode = futures[future]
+                try:
+                    result = future.result()
+                    logger.info(f"✅ {postcode} done: {result['listings']} listings in "
+                                f"{result['elapsed']}s ({result['listings_per_sec']} listings/s)")
+                except Exception as e:
+                    logger.error(f"❌ Ingest failed for {postcode}: {e}")
+                    result = {"postcode": postcode, "error": str(e)}
+                results.append(result)
+            report_progress(job_id, start)
+
+    logger.info(f"Batch {job_id} finished in {time.time() - start:.0f}s")
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    outcodes = [("E14", "5E749"),
+                ("SW1V", "5E2510")]
+    for result in run_batch(outcodes, pages=42):
+        print(result)
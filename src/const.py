@@ -16,6 +16,7 @@ col_flat_to_rent = [
     "second_nearest_station", 
     "distance_to_second_station", 
     "run_time",
+    "property_id",
 ]
 
 col_travel = [
@@ -31,4 +32,23 @@ col_scores = [
     "confort_score",
     "transport_score",
     "combined_score",
-]
\ No newline at end of file
+]
+
+# default commute destinations (City of London) and their walk time in minutes
+bank_station_code = "940GZZLUBNK"
+aldgate_station_code = "940GZZLUALD"
+liverpool_st_station_code = "940GZZLULVT"
+tower_hill_station_code = "940GZZLUTWH"
+tower_gateway_station_code = "9400ZZDLTWG"
+
+dict_destination = {bank_station_code: 9,
+             aldgate_station_code: 5,
+             liverpool_st_station_code: 12,
+             tower_hill_station_code: 10,
+             tower_gateway_station_code: 10}
+
+destination_name_mapping = {bank_station_code: "Bank",
+             aldgate_station_code: "Aldgate",
+             liverpool_st_station_code: "Liverpool Street",
+             tower_hill_station_code: "Tower Hill",
+             tower_gateway_station_code: "Tower Gateway"}
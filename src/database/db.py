@@ -1,9 +1,13 @@
+import datetime
+import os
+import re
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import cast, create_engine, delete, event, insert, or_, select, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey
+from sqlalchemy import Boolean, Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, func
 from sqlalchemy import inspect
+import src.const as const
 # SQLite 连接（文件名为 tasks.db）
 SQLALCHEMY_DATABASE_URL = "sqlite:///./tasks.db"
 
@@ -11,6 +15,33 @@ SQLALCHEMY_DATABASE_URL = "sqlite:///./tasks.db"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+
+# SQLite pragmas applied to every new connection. WAL lets the API keep
+# reading while an ingest writes; "safe" trades write speed for durability.
+STORAGE_PROFILES = {
+    "default": {"journal_mode": "WAL",
+                "synchronous": "NORMAL",
+                "mmap_size": 256 * 1024 * 1024,
+                "cache_size": -64000,  # negative = KiB, i.e. 64 MB
+                "temp_store": "MEMORY",
+                "busy_timeout": 5000},
+    "safe": {"journal_mode": "WAL",
+             "synchronous": "FULL",
+             "busy_timeout": 5000},
+    "none": {},
+}
+STORAGE_PROFILE = os.environ.get("PROPERTY_DB_PROFILE", "default")
+
+
+@event.listens_for(engine, "connect")
+def apply_storage_profile(dbapi_connection, connection_record):
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in STORAGE_PROFILES[STORAGE_PROFILE].items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -38,6 +69,22 @@ class FlatsToRent(Base):
     # confort_score = Column(Float)
     # combined_score = Column(Float)
     run_time = Column(Date)
+    # rightmove's own listing id, stable across runs (parsed from `link`),
+    # also the unique_id of every listing that has one
+    property_id = Column(String(20))
+
+    __table_args__ = (
+        # covers the /rent stats group-bys and the delete filters
+        Index("ix_flats_to_rent_postcode_type_rooms_price",
+              "postcode", "property_type", "number_of_bedroom", "number_of_bathroom", "price"),
+        # join key for station travel times
+        Index("ix_flats_to_rent_nearest_station", "nearest_station"),
+        # dashboard price and image count range filters
+        Index("ix_flats_to_rent_price", "price"),
+        Index("ix_flats_to_rent_num_image", "num_image"),
+        # one row per rightmove listing, rescrapes update it in place
+        Index("ux_flats_to_rent_property_id", "property_id", unique=True),
+    )
 
     # Relationship to Score
     # score = relationship("Score", back_populates="flat", uselist=False, cascade="all, delete-orphan")
@@ -65,9 +112,241 @@ class Score(Base):
     confort_score = Column(Float)
     transport_score = Column(Float)
     combined_score = Column(Float)
+    # un-normalised price score and the inputs it was computed from,
+    # used to rescore only new or changed listings
+    price_score_raw = Column(Float)
+    inputs_key = Column(String(200))
+    scored_at = Column(DateTime)
 
     # flat = relationship("FlatsToRent", back_populates="score")
 
+class ScoreDistribution(Base):
+    # running count / sum / sum of squares of a raw score over all scored listings
+    __tablename__ = "score_distribution"
+
+    metric = Column(String(50), primary_key=True)
+    count = Column(Integer)
+    total = Column(Float)
+    total_sq = Column(Float)
+
+class PostcodeStats(Base):
+    __tablename__ = "postcode_stats"
+
+    # price aggregates per postcode/type/bedrooms, kept in sync with flats_to_rent
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    postcode = Column(String(50), nullable=False, index=True)
+    property_type = Column(String(50))
+    number_of_bedroom = Column(Integer)
+    count = Column(Integer)
+    min_price = Column(Integer)
+    max_price = Column(Integer)
+    sum_price = Column(Float)
+    sum_price_sq = Column(Float)
+
+class IngestCheckpoint(Base):
+    __tablename__ = "ingest_checkpoints"
+
+    # one row per search results page persisted by a batch ingest job
+    job_id = Column(String(50), primary_key=True)
+    postcode = Column(String(50), primary_key=True)
+    page = Column(Integer, primary_key=True)
+    listings = Column(Integer)
+    completed_at = Column(DateTime)
+
+class ListingObservation(Base):
+    __tablename__ = "listing_observations"
+
+    # price history: one row per listing and day it was scraped,
+    # flats_to_rent only keeps the latest state
+    unique_id = Column(String(50), primary_key=True)
+    observed_on = Column(Date, primary_key=True)
+    price = Column(Integer)
+
+class DataVersion(Base):
+    __tablename__ = "data_version"
+
+    # bumped in the same transaction as every write to a dataset, readers
+    # key their caches on it instead of re-querying the data
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime)
+
+PROPERTY_ID_PATTERN = re.compile(r"/properties/(\d+)")
+
+
+def property_id_from_link(link):
+    match = PROPERTY_ID_PATTERN.search(link) if link else None
+    return match.group(1) if match else None
+
+
+def listing_key(link, fallback):
+    # canonical listing id, the same for every scrape of a property
+    return property_id_from_link(link) or fallback
+
+
+def observations_from(df):
+    df = df[["unique_id", "run_time", "price"]].rename(columns={"run_time": "observed_on"})
+    df = df.assign(observed_on=pd.to_datetime(df["observed_on"]).dt.date).dropna(subset=["observed_on"])
+    return df.drop_duplicates(["unique_id", "observed_on"], keep="last")
+
+
+def merge_duplicate_listings(conn):
+    """Collapse stored copies of the same property into one canonical row.
+
+    Rows written before listings were keyed by property id are merged
+    into the most recently scraped copy, re-keyed to the property id.
+    Every copy's price is kept in listing_observations first.
+    """
+    df = pd.DataFrame(conn.execute(text("SELECT unique_id, property_id, run_time, price FROM flats_to_rent "
+                                        "WHERE property_id IS NOT NULL")).fetchall(),
+                      columns=["unique_id", "property_id", "run_time", "price"])
+    stale = df[df["unique_id"] != df["property_id"]]
+    if stale.empty:
+        return
+    groups = df[df["property_id"].isin(stale["property_id"])]
+    bulk_write(ListingObservation.__table__,
+               observations_from(groups.assign(unique_id=groups["property_id"])), conn)
+
+    # latest scrape wins, a copy already keyed by property id wins ties
+    groups = groups.assign(canonical=groups["unique_id"] == groups["property_id"],
+                           run_time=groups["run_time"].fillna("").astype(str))
+    keep = groups.sort_values(["run_time", "canonical"]).drop_duplicates("property_id", keep="last")
+    dropped = [{"unique_id": unique_id} for unique_id in groups["unique_id"] if unique_id not in set(keep["unique_id"])]
+    rekeyed = [{"old": row.unique_id, "new": row.property_id}
+               for row in keep.itertuples() if row.unique_id != row.property_id]
+    for table in ("scores", "flats_to_rent"):
+        if dropped:
+            conn.execute(text(f"DELETE FROM {table} WHERE unique_id = :unique_id"), dropped)
+        if rekeyed:
+            conn.execute(text(f"UPDATE {table} SET unique_id = :new WHERE unique_id = :old"), rekeyed)
+    if dropped:
+        refresh_postcode_stats(conn)
+        # scores were normalised over the duplicates, the next scoring pass starts over
+        conn.execute(delete(ScoreDistribution.__table__))
+    bump_data_version(conn, "listings", "scores")
+    print(f"✅ Merged {len(groups)} stored rows into {len(keep)} listings keyed by property id.")
+
+
+def refresh_postcode_stats(conn, postcodes=None):
+    """Re-aggregate postcode_stats for `postcodes` (all when None) on `conn`.
+
+    Called in the same transaction as every write to flats_to_rent. Only
+    the touched postcodes are recomputed, which the covering
+    postcode/type/rooms/price index serves without reading the table.
+    """
+    stats = PostcodeStats.__table__
+    flats = FlatsToRent.__table__
+    clear = delete(stats)
+    aggregate = select(flats.c.postcode,
+                       flats.c.property_type,
+                       flats.c.number_of_bedroom,
+                       func.count(flats.c.price),
+                       func.min(flats.c.price),
+                       func.max(flats.c.price),
+                       func.sum(flats.c.price),
+                       func.sum(flats.c.price * flats.c.price))
+    if postcodes is not None:
+        postcodes = list(postcodes)
+        if not postcodes:
+            return
+        clear = clear.where(stats.c.postcode.in_(postcodes))
+        aggregate = aggregate.where(flats.c.postcode.in_(postcodes))
+    aggregate = aggregate.group_by(flats.c.postcode,
+                                   flats.c.property_type,
+                                   flats.c.number_of_bedroom)
+    conn.execute(clear)
+    conn.execute(insert(stats).from_select(["postcode",
+                                            "property_type",
+                                            "number_of_bedroom",
+                                            "count",
+                                            "min_price",
+                                            "max_price",
+                                            "sum_price",
+                                            "sum_price_sq"],
+                                           aggregate))
+
+
+def bump_data_version(conn, *names):
+    table = DataVersion.__table__
+    now = datetime.datetime.now()
+    for name in names:
+        updated = conn.execute(table.update()
+                               .where(table.c.name == name)
+                               .values(version=table.c.version + 1, updated_at=now)).rowcount
+        if not updated:
+            conn.execute(table.insert().values(name=name, version=1, updated_at=now))
+
+
+def get_data_version(*names):
+    # current version of each dataset, 0 for one that was never written
+    ensure_table(DataVersion)
+    table = DataVersion.__table__
+    with engine.connect() as conn:
+        versions = dict(conn.execute(select(table.c.name, table.c.version)
+                                     .where(table.c.name.in_(names))).fetchall())
+    return tuple(versions.get(name, 0) for name in names)
+
+
+def upgrade_db():
+    # bring tables created by older versions up to the current models
+    with engine.begin() as conn:
+        conn_inspector = inspect(conn)
+        existing_tables = set(conn_inspector.get_table_names())
+
+        # columns added to the models after their table was created
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {column["name"] for column in conn_inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    column_type = column.type.compile(dialect=conn.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    print(f"✅ Added column {table.name}.{column.name}")
+
+        rows = conn.execute(text("SELECT unique_id, link FROM flats_to_rent WHERE property_id IS NULL AND link IS NOT NULL")).fetchall()
+        params = [{"unique_id": unique_id, "property_id": property_id_from_link(link)} for unique_id, link in rows]
+        params = [param for param in params if param["property_id"] is not None]
+        if params:
+            conn.execute(text("UPDATE flats_to_rent SET property_id = :property_id WHERE unique_id = :unique_id"), params)
+            print(f"✅ Backfilled property_id for {len(params)} records.")
+
+        # price history of listings stored before observations were recorded
+        if conn.execute(text("SELECT 1 FROM listing_observations LIMIT 1")).first() is None:
+            rows = conn.execute(text("SELECT COALESCE(property_id, unique_id), run_time, price FROM flats_to_rent")).fetchall()
+            if rows:
+                bulk_write(ListingObservation.__table__,
+                           observations_from(pd.DataFrame(rows, columns=["unique_id", "run_time", "price"])), conn)
+        # must run before the unique property_id index is created below
+        merge_duplicate_listings(conn)
+        conn.execute(text("DROP INDEX IF EXISTS ix_flats_to_rent_property_id"))
+        # listings are looked up by property_id, nothing reads link through an index
+        conn.execute(text("DROP INDEX IF EXISTS ix_flats_to_rent_link"))
+
+        # indexes added to the models after their table was created
+        existing = {table: {index["name"] for index in conn_inspector.get_indexes(table)}
+                    for table in existing_tables}
+        created = []
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in existing.get(table.name, ()):
+                    index.create(bind=conn, checkfirst=True)
+                    created.append(index.name)
+        if created:
+            # refresh planner statistics so the new indexes get used
+            conn.execute(text("ANALYZE"))
+            print(f"✅ Created indexes: {created}")
+
+        # summary table added after flats were already stored
+        if conn.execute(text("SELECT 1 FROM postcode_stats LIMIT 1")).first() is None:
+            refresh_postcode_stats(conn)
+
+        # destinations table added after travel times were already stored
+        if conn.execute(text("SELECT 1 FROM commute_destination LIMIT 1")).first() is None:
+            bulk_write(CommuteDestination.__table__, default_destinations(), conn)
+            bump_data_version(conn, "travel_times")
+
+
 def init_db():
     # 删除旧数据库（仅测试时启用）
     # import os
@@ -76,6 +355,7 @@ def init_db():
 
     # Create all tables
     Base.metadata.create_all(bind=engine)
+    upgrade_db()
 
     # 验证表和数据
     from sqlalchemy import inspect
@@ -84,6 +364,71 @@ def init_db():
 
 
 
+class ScrapeJob(Base):
+    __tablename__ = "scrape_jobs"
+
+    # persisted queue of POST /rent requests, see src/jobs.py
+    id = Column(String(32), primary_key=True)
+    postcode = Column(String(50), nullable=False)
+    loc_code = Column(String(50), nullable=False)
+    pages = Column(Integer)
+    state = Column(String(20), nullable=False, index=True)
+    pages_done = Column(Integer, default=0)
+    # pages whose insert failed in the last attempt, retried when the job is resumed
+    pages_failed = Column(Integer, default=0)
+    listings = Column(Integer, default=0)
+    error = Column(String(500))
+    cancel_requested = Column(Boolean, default=False)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    def to_dict(self):
+        end = self.finished_at or datetime.datetime.now()
+        return {"id": self.id,
+                "postcode": self.postcode,
+                "loc_code": self.loc_code,
+                "pages": self.pages,
+                "state": self.state,
+                "pages_done": self.pages_done,
+                "pages_failed": self.pages_failed or 0,
+                "listings": self.listings,
+                "elapsed": round((end - self.started_at).total_seconds(), 1) if self.started_at else None,
+                "error": self.error,
+                "cancel_requested": self.cancel_requested,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at}
+
+class JourneyTimeCache(Base):
+    __tablename__ = "journey_time_cache"
+
+    # TfL journey durations by origin, destination and date/time band, see src/tfl.py
+    from_station = Column(String(11), primary_key=True)
+    to_station = Column(String(11), primary_key=True)
+    time_band = Column(String(20), primary_key=True)
+    duration = Column(Integer)
+    fetched_at = Column(DateTime, index=True)
+
+class CommuteDestination(Base):
+    __tablename__ = "commute_destination"
+
+    # NaPTAN id of a station users commute to, and the walk from it to the office
+    destination_code = Column(String(11), primary_key=True)
+    name = Column(String(100))
+    walk_time = Column(Integer)
+    is_default = Column(Boolean, default=False)
+
+class StationDestinationTime(Base):
+    __tablename__ = "station_destination_time"
+
+    # journey time in minutes from every mapped station to every destination
+    station_code = Column(String(11), primary_key=True)
+    destination_code = Column(String(11), primary_key=True, index=True)
+    travel_time = Column(Float)
+    source = Column(String(10))
+    updated_at = Column(DateTime)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -94,6 +439,8 @@ def get_db():
 def reset_flats_table(session):
     try:
         session.query(FlatsToRent).delete()
+        session.query(PostcodeStats).delete()
+        bump_data_version(session.connection(), "listings")
         session.commit()
         print("✅ All records deleted from flats_to_rent.")
     except Exception as e:
@@ -103,122 +450,394 @@ def reset_flats_table(session):
         session.close()
 
 
-def insert_dataframe_to_db(df):
+def get_completed_pages(job_id, postcode):
+    session = SessionLocal()
+    try:
+        rows = session.query(IngestCheckpoint.page).filter(IngestCheckpoint.job_id == job_id,
+                                                           IngestCheckpoint.postcode == postcode).all()
+        return {row.page for row in rows}
+    finally:
+        session.close()
+
+
+def get_job_progress(job_id):
     session = SessionLocal()
+    try:
+        rows = session.query(IngestCheckpoint.postcode,
+                             func.count(IngestCheckpoint.page).label("pages"),
+                             func.sum(IngestCheckpoint.listings).label("listings"),
+                             func.min(IngestCheckpoint.completed_at).label("first_page_at"),
+                             func.max(IngestCheckpoint.completed_at).label("last_page_at"))\
+                      .filter(IngestCheckpoint.job_id == job_id)\
+                      .group_by(IngestCheckpoint.postcode).all()
+        return [row._asdict() for row in rows]
+    finally:
+        session.close()
+
 
+def create_job(job_id, postcode, loc_code, pages=None):
+    session = SessionLocal()
     try:
-        flats = []
-        for _, row in df.iterrows():
-            flat = FlatsToRent(
-                unique_id=row["unique_id"],
-                postcode=row["postcode"],
-                property_type=row["property_type"],
-                address=row["address"],
-                rent=row["rent"],
-                price=row["price"],
-                base=row["base"],
-                number_of_bedroom=int(row["number_of_bedroom"]) if pd.notnull(row["number_of_bedroom"]) else None,
-                number_of_bathroom=int(row["number_of_bathroom"]) if pd.notnull(row["number_of_bathroom"]) else None,
-                description=row["description"],
-                num_image=row["num_image"],
-                link = row["link"],
-                nearest_station=row["nearest_station"],
-                distance_to_station=row["distance_to_station"],
-                second_nearest_station=row["second_nearest_station"],
-                distance_to_second_station=row["distance_to_second_station"],
-                # price_score = row["price_score"],
-                # confort_score = row["confort_score"],
-                # combined_score = row["combined_score"],
-                run_time=row["run_time"].date()
-            )
-            flats.append(flat)
-
-        session.bulk_save_objects(flats)
+        job = ScrapeJob(id=job_id,
+                        postcode=postcode,
+                        loc_code=loc_code,
+                        pages=pages,
+                        state="queued",
+                        pages_done=0,
+                        pages_failed=0,
+                        listings=0,
+                        cancel_requested=False,
+                        created_at=datetime.datetime.now())
+        session.add(job)
         session.commit()
-        print(f"✅ Inserted {len(flats)} records into the database.")
-    except Exception as e:
-        session.rollback()
-        print("❌ Error inserting data:", e)
+        return job.to_dict()
     finally:
         session.close()
 
 
-def insert_station_mapping_to_db(df):
-    inspector = inspect(engine)
-    if "station_code" not in inspector.get_table_names():
-        init_db()
+def get_job(job_id):
+    session = SessionLocal()
+    try:
+        job = session.get(ScrapeJob, job_id)
+        return job.to_dict() if job else None
+    finally:
+        session.close()
 
+
+def list_jobs(state=None, limit=50):
     session = SessionLocal()
+    try:
+        query = session.query(ScrapeJob)
+        if state is not None:
+            query = query.filter(ScrapeJob.state == state)
+        return [job.to_dict() for job in query.order_by(ScrapeJob.created_at.desc()).limit(limit)]
+    finally:
+        session.close()
+
 
+def update_job(job_id, **fields):
+    session = SessionLocal()
     try:
-        stations = []
-        for _, row in df.iterrows():
-            station = StationCode(
-                station_name=row["station_name"],
-                station_code=row["naptanID"],
-            )
-            stations.append(station)
-
-        session.bulk_save_objects(stations)
+        session.query(ScrapeJob).filter(ScrapeJob.id == job_id).update(fields)
         session.commit()
-        print(f"✅ Inserted {len(stations)} records into the database.")
-    except Exception as e:
-        session.rollback()
-        print("❌ Error inserting data:", e)
     finally:
         session.close()
 
-def insert_travel_time_to_db(df):
-    inspector = inspect(engine)
-    print(inspector.get_table_names())
-    if "stations_travel_time" not in inspector.get_table_names():
-        init_db()
-    session = SessionLocal()
 
+def record_job_page(job_id, listings):
+    # bump progress after a persisted page, returns whether cancellation was requested
+    session = SessionLocal()
     try:
-        stations = []
-        for _, row in df.iterrows():
-            station = StationsTravelTime(
-                station_name=row["station_name"],
-                destination=row["best_destination"],
-                travel_time=row["min_duration"],
-                walk_time=row["walk_to_dest"],
-            )
-            stations.append(station)
-
-        session.bulk_save_objects(stations)
+        session.query(ScrapeJob).filter(ScrapeJob.id == job_id)\
+               .update({ScrapeJob.pages_done: ScrapeJob.pages_done + 1,
+                        ScrapeJob.listings: ScrapeJob.listings + listings})
         session.commit()
-        print(f"✅ Inserted {len(stations)} records into the database.")
-    except Exception as e:
-        session.rollback()
-        print("❌ Error inserting data:", e)
+        return bool(session.query(ScrapeJob.cancel_requested).filter(ScrapeJob.id == job_id).scalar())
     finally:
         session.close()
 
-def insert_scores(df):
-    inspector = inspect(engine)
-    print(inspector.get_table_names())
-    if "scores" not in inspector.get_table_names():
-        init_db()
+
+def get_known_listings(property_ids):
+    # property_id -> {(rent, description)} of the stored listing, listings
+    # whose station lookup failed are left out so they are fetched again
+    if not property_ids:
+        return {}
     session = SessionLocal()
+    try:
+        rows = session.query(FlatsToRent.property_id,
+                             FlatsToRent.rent,
+                             FlatsToRent.description)\
+                      .filter(FlatsToRent.property_id.in_(list(property_ids)),
+                              FlatsToRent.nearest_station.isnot(None)).all()
+        known = {}
+        for property_id, rent, description in rows:
+            known.setdefault(property_id, set()).add((rent, description))
+        return known
+    finally:
+        session.close()
+
+
+def upsert_statement(table, conflict_keys, update_columns, bind=None):
+    # INSERT ... ON CONFLICT DO UPDATE in the engine's own dialect
+    bind = bind if bind is not None else engine
+    if bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif bind.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f"Upsert is not supported for {bind.dialect.name}")
+    stmt = insert(table)
+    if not update_columns:
+        return stmt.on_conflict_do_nothing(index_elements=conflict_keys)
+    return stmt.on_conflict_do_update(index_elements=conflict_keys,
+                                      set_={col: stmt.excluded[col] for col in update_columns})
+
+
+def dataframe_to_params(df, columns):
+    # column-wise conversion, NaN/NaT become NULL
+    values = [df[col].astype(object).where(df[col].notna(), None).tolist() for col in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def bulk_write(table,
+               df,
+               conn,
+               upsert: bool = True,
+               chunk_size: int = 5000):
+    """Write `df` (columns named after `table`'s columns) with executemany in chunks.
+
+    With `upsert`, rows whose primary key already exists are updated in
+    place instead of failing the whole batch.
+    """
+    columns = [col.name for col in table.columns if col.name in df.columns]
+    if upsert:
+        conflict_keys = [col.name for col in table.primary_key.columns]
+        stmt = upsert_statement(table,
+                                conflict_keys,
+                                [col for col in columns if col not in conflict_keys],
+                                conn)
+    else:
+        stmt = table.insert()
+    for start in range(0, len(df), chunk_size):
+        conn.execute(stmt, dataframe_to_params(df.iloc[start:start + chunk_size], columns))
+    return len(df)
+
+
+_ready_tables = set()
+
+
+def ensure_table(model):
+    # create a missing table once per process instead of inspecting on every insert
+    if model.__tablename__ not in _ready_tables:
+        model.__table__.create(bind=engine, checkfirst=True)
+        _ready_tables.add(model.__tablename__)
+
+
+def insert_dataframe_to_db(df, checkpoint=None, seen=None):
+    """Upsert listings by their canonical unique_id and record today's prices.
+
+    `seen` holds listings scraped again unchanged, only their price
+    observation is written.
+    """
+    ensure_table(FlatsToRent)
+    ensure_table(PostcodeStats)
+    ensure_table(ListingObservation)
+    ensure_table(DataVersion)
+    if checkpoint is not None:
+        ensure_table(IngestCheckpoint)
+    df = df.copy()
+    df["number_of_bedroom"] = pd.to_numeric(df["number_of_bedroom"]).astype("Int64")
+    df["number_of_bathroom"] = pd.to_numeric(df["number_of_bathroom"]).astype("Int64")
+    df["run_time"] = pd.to_datetime(df["run_time"]).dt.date
 
     try:
-        scores = []
-        for _, row in df.iterrows():
-            score = Score(
-                unique_id=row["unique_id"],
-                price_score = row["price_score"],
-                confort_score = row["confort_score"],
-                transport_score = row["transport_score"],
-                combined_score = row["combined_score"],
-            )
-            scores.append(score)
-
-        session.bulk_save_objects(scores)
-        session.commit()
-        print(f"✅ Inserted {len(scores)} records into the database.")
+        with engine.begin() as conn:
+            count = bulk_write(FlatsToRent.__table__, df, conn)
+            observed = df if seen is None or seen.empty else pd.concat([df, seen], ignore_index=True)
+            if not observed.empty:
+                bulk_write(ListingObservation.__table__, observations_from(observed), conn)
+            refresh_postcode_stats(conn, df["postcode"].unique())
+            bump_data_version(conn, "listings")
+            # committed together with the rows so a page is never half persisted
+            if checkpoint is not None:
+                bulk_write(IngestCheckpoint.__table__, pd.DataFrame([checkpoint]), conn)
+        print(f"✅ Inserted {count} records into the database.")
+        return True
     except Exception as e:
-        session.rollback()
         print("❌ Error inserting data:", e)
-    finally:
-        session.close()
\ No newline at end of file
+        return False
+
+
+def insert_station_mapping_to_db(df):
+    ensure_table(StationCode)
+    ensure_table(DataVersion)
+    df = df.rename(columns={"naptanID": "station_code"})
+
+    try:
+        with engine.begin() as conn:
+            count = bulk_write(StationCode.__table__, df, conn)
+            bump_data_version(conn, "travel_times")
+        print(f"✅ Inserted {count} records into the database.")
+    except Exception as e:
+        print("❌ Error inserting data:", e)
+
+def insert_travel_time_to_db(df):
+    ensure_table(StationsTravelTime)
+    ensure_table(DataVersion)
+    df = df.rename(columns={"best_destination": "destination",
+                            "min_duration": "travel_time",
+                            "walk_to_dest": "walk_time"})
+
+    try:
+        with engine.begin() as conn:
+            count = bulk_write(StationsTravelTime.__table__, df, conn)
+            bump_data_version(conn, "travel_times")
+        print(f"✅ Inserted {count} records into the database.")
+    except Exception as e:
+        print("❌ Error inserting data:", e)
+
+def get_cached_journey_times(pairs, time_band, ttl):
+    # {(from, to): duration} for the pairs fetched within `ttl`
+    ensure_table(JourneyTimeCache)
+    pairs = set(pairs)
+    table = JourneyTimeCache.__table__
+    with engine.connect() as conn:
+        rows = conn.execute(select(table.c.from_station, table.c.to_station, table.c.duration)
+                            .where(table.c.time_band == time_band,
+                                   table.c.fetched_at >= datetime.datetime.now() - ttl,
+                                   table.c.from_station.in_({from_station for from_station, _ in pairs})))
+        return {(from_station, to_station): duration for from_station, to_station, duration in rows
+                if (from_station, to_station) in pairs}
+
+
+def save_journey_times(durations, time_band):
+    ensure_table(JourneyTimeCache)
+    fetched_at = datetime.datetime.now()
+    df = pd.DataFrame([{"from_station": from_station,
+                        "to_station": to_station,
+                        "time_band": time_band,
+                        "duration": duration,
+                        "fetched_at": fetched_at}
+                       for (from_station, to_station), duration in durations.items()])
+    if df.empty:
+        return 0
+    with engine.begin() as conn:
+        return bulk_write(JourneyTimeCache.__table__, df, conn)
+
+
+def evict_expired_journey_times(ttl):
+    ensure_table(JourneyTimeCache)
+    with engine.begin() as conn:
+        return conn.execute(delete(JourneyTimeCache.__table__)
+                            .where(JourneyTimeCache.fetched_at < datetime.datetime.now() - ttl)).rowcount
+
+
+def get_destinations(codes=None):
+    ensure_table(CommuteDestination)
+    query = select(CommuteDestination.__table__)
+    if codes is not None:
+        query = query.where(CommuteDestination.destination_code.in_(codes))
+    with engine.connect() as conn:
+        result = conn.execute(query)
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+
+def default_destinations():
+    return pd.DataFrame([{"destination_code": code,
+                          "name": const.destination_name_mapping[code],
+                          "walk_time": walk_time,
+                          "is_default": True}
+                         for code, walk_time in const.dict_destination.items()])
+
+
+def save_destinations(df):
+    ensure_table(CommuteDestination)
+    ensure_table(DataVersion)
+    with engine.begin() as conn:
+        count = bulk_write(CommuteDestination.__table__, df, conn)
+        bump_data_version(conn, "travel_times")
+        return count
+
+
+def get_mapped_station_codes():
+    with engine.connect() as conn:
+        result = conn.execute(text("SELECT station_name, station_code FROM station_code WHERE station_code IS NOT NULL"))
+        return pd.DataFrame(result.fetchall(), columns=["station_name", "station_code"])
+
+
+def get_station_destination_times(station_codes=None, destination_codes=None):
+    # long format: station_code, destination_code, travel_time
+    ensure_table(StationDestinationTime)
+    table = StationDestinationTime.__table__
+    query = select(table.c.station_code, table.c.destination_code, table.c.travel_time)
+    if station_codes is not None:
+        query = query.where(table.c.station_code.in_(station_codes))
+    if destination_codes is not None:
+        query = query.where(table.c.destination_code.in_(destination_codes))
+    with engine.connect() as conn:
+        return pd.DataFrame(conn.execute(query).fetchall(),
+                            columns=["station_code", "destination_code", "travel_time"])
+
+
+def save_station_destination_times(df):
+    ensure_table(StationDestinationTime)
+    ensure_table(DataVersion)
+    df = df.assign(updated_at=datetime.datetime.now())
+    with engine.begin() as conn:
+        count = bulk_write(StationDestinationTime.__table__, df, conn)
+        bump_data_version(conn, "travel_times")
+        return count
+
+
+def score_inputs_key(flats, travel):
+    # the listing fields a score depends on, joined into one comparable string
+    parts = [flats.c.price,
+             flats.c.number_of_bedroom,
+             flats.c.number_of_bathroom,
+             flats.c.distance_to_station,
+             travel.c.travel_time,
+             travel.c.walk_time]
+    key = None
+    for part in parts:
+        part = func.coalesce(cast(part, String), "")
+        key = part if key is None else key + "|" + part
+    return key
+
+
+def select_flats_to_score(only_changed=True, limit=None):
+    """Flats joined with their station travel time, ready for scoring.
+
+    With `only_changed`, only listings that were never scored or whose
+    score inputs changed since they were last scored are returned, along
+    with their previous raw price score.
+    """
+    ensure_table(Score)
+    flats = FlatsToRent.__table__
+    travel = StationsTravelTime.__table__
+    scores = Score.__table__
+    station = func.replace(flats.c.nearest_station, " Station", "")
+    inputs_key = score_inputs_key(flats, travel)
+    columns = [station.label(col) if col == "nearest_station" else flats.c[col]
+               for col in const.col_flat_to_rent]
+    query = (select(*columns,
+                    *[travel.c[col] for col in const.col_travel[1:]],
+                    inputs_key.label("inputs_key"),
+                    scores.c.price_score_raw.label("previous_price_score_raw"))
+             .select_from(flats
+                          .outerjoin(travel, travel.c.station_name == station)
+                          .outerjoin(scores, scores.c.unique_id == flats.c.unique_id)))
+    if only_changed:
+        query = query.where(or_(scores.c.unique_id.is_(None),
+                                scores.c.inputs_key.is_distinct_from(inputs_key)))
+    if limit is not None:
+        query = query.limit(limit)
+    with engine.connect() as conn:
+        result = conn.execute(query)
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+
+def get_score_distribution(metric):
+    ensure_table(ScoreDistribution)
+    with engine.connect() as conn:
+        row = conn.execute(select(ScoreDistribution.__table__)
+                           .where(ScoreDistribution.metric == metric)).mappings().first()
+        return dict(row) if row is not None else None
+
+
+def insert_scores(df, distribution=None):
+    ensure_table(Score)
+    ensure_table(ScoreDistribution)
+    ensure_table(DataVersion)
+
+    try:
+        # scores and the running distribution they were normalised with move together
+        with engine.begin() as conn:
+            count = bulk_write(Score.__table__, df, conn)
+            if distribution is not None:
+                bulk_write(ScoreDistribution.__table__, pd.DataFrame([distribution]), conn)
+            bump_data_version(conn, "scores")
+        print(f"✅ Inserted {count} records into the database.")
+        return True
+    except Exception as e:
+        print("❌ Error inserting data:", e)
+        return False
@@ -0,0 +1,109 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+def make_driver(browser: str = "chrome",
+                headless: bool = True):
+    # imported here so HTTP-only ingests don't need selenium installed
+    from selenium import webdriver
+
+    if browser == "chrome":
+        options = webdriver.ChromeOptions()
+        if headless:
+            options.add_argument("--headless=new")
+        # required when running inside containers / linux workers
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        return webdriver.Chrome(options=options)
+    elif browser == "firefox":
+        options = webdriver.FirefoxOptions()
+        if headless:
+            options.add_argument("-headless")
+        return webdriver.Firefox(options=options)
+    elif browser == "safari":
+        # safari has no headless mode
+        return webdriver.Safari()
+    raise ValueError(f"Unsupported browser: {browser}")
+
+
+class StationWorkerPool:
+    """Pool of workers resolving listing links to (station, distance) pairs.
+
+    Each worker thread pulls links from a shared queue and calls
+    `extract(get_driver, url)`. `get_driver` returns the worker's own driver,
+    created on first use, so extractors that never need a browser never
+    start one. `submit` returns a Future so the caller can keep parsing
+    listing cards while lookups are in flight.
+    """
+
+    def __init__(self,
+                 extract,
+                 workers: int = 4,
+                 driver_factory=make_driver):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.extract = extract
+        self.driver_factory = driver_factory
+        self._queue = queue.Queue()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work,
+                                      name=f"station-worker-{i}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        driver = None
+
+        def get_driver():
+            nonlocal driver
+            if driver is None:
+                driver = self.driver_factory()
+            return driver
+
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    break
+                url, future = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self.extract(get_driver, url))
+                except Exception as e:
+                    logger.error(f"❌ Station worker failed for {url}: {e}")
+                    future.set_exception(e)
+        finally:
+            if driver is not None:
+                driver.quit()
+
+    def submit(self, url: str) -> Future:
+        future = Future()
+        self._queue.put((url, future))
+        return future
+
+    def close(self):
+        # lookups still queued are cancelled, workers only finish the one in hand
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job[1].cancel()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
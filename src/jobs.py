@@ -0,0 +1,106 @@
+import datetime
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from .database import db
+from .scrapping import PagePersistError, wrapper
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobRunner:
+    """Runs scrape jobs from the scrape_jobs table on a pool of worker threads.
+
+    The table is the queue: a job is persisted as "queued" before it is
+    handed to the pool, and `resume_pending` re-submits whatever a previous
+    server process left queued or running. The job id doubles as the
+    ingest checkpoint id, so a resumed job skips pages it already stored.
+    """
+
+    def __init__(self, workers: int = 2):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="scrape-job")
+            return self._executor
+
+    def submit(self, postcode: str, loc_code: str, pages: int = None):
+        job = db.create_job(uuid.uuid4().hex, postcode, loc_code, pages)
+        self._pool().submit(self._run, job["id"])
+        return job
+
+    def resume_pending(self):
+        jobs = db.list_jobs(state="queued", limit=None) + db.list_jobs(state="running", limit=None)
+        for job in sorted(jobs, key=lambda job: job["created_at"]):
+            logger.info(f"Resuming scrape job {job['id']} for {job['postcode']}")
+            self._pool().submit(self._run, job["id"])
+        return len(jobs)
+
+    def cancel(self, job_id: str):
+        job = db.get_job(job_id)
+        if job is None:
+            return None
+        if job["state"] == "queued":
+            db.update_job(job_id,
+                          state="cancelled",
+                          cancel_requested=True,
+                          finished_at=datetime.datetime.now())
+        elif job["state"] == "running":
+            # picked up by the job after its current page
+            db.update_job(job_id, cancel_requested=True)
+        return db.get_job(job_id)
+
+    def _run(self, job_id: str):
+        job = db.get_job(job_id)
+        if job is None or job["state"] not in ("queued", "running"):
+            return
+        db.update_job(job_id,
+                      state="running",
+                      pages_failed=0,
+                      started_at=job["started_at"] or datetime.datetime.now())
+
+        def on_page(df_page):
+            if db.record_job_page(job_id, len(df_page)):
+                raise JobCancelled()
+
+        kwargs = {"pages": job["pages"]} if job["pages"] is not None else {}
+        try:
+            logger.info(f"Starting scrape job {job_id} for postcode: {job['postcode']}")
+            wrapper(job["postcode"], job["loc_code"], job_id=job_id, on_page=on_page, **kwargs)
+            db.update_job(job_id, state="done", finished_at=datetime.datetime.now())
+            logger.info(f"Scrape job {job_id} completed")
+        except JobCancelled:
+            db.update_job(job_id, state="cancelled", finished_at=datetime.datetime.now())
+            logger.info(f"Scrape job {job_id} cancelled")
+        except PagePersistError as e:
+            logger.error(f"Scrape job {job_id} failed: {e}")
+            db.update_job(job_id,
+                          state="failed",
+                          pages_failed=len(e.pages),
+                          error=str(e)[:500],
+                          finished_at=datetime.datetime.now())
+        except Exception as e:
+            logger.error(f"Error in scrape job {job_id}: {str(e)}", exc_info=True)
+            db.update_job(job_id,
+                          state="failed",
+                          error=str(e)[:500],
+                          finished_at=datetime.datetime.now())
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+job_runner = JobRunner()
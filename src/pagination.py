@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class HostRateLimiter:
+    """Spaces out request starts so each host sees at most `rate` requests per second."""
+
+    def __init__(self, rate: float = None):
+        self.interval = 1 / rate if rate else 0
+        self._next_slot = {}
+        self._lock = asyncio.Lock()
+
+    async def wait(self, host: str):
+        async with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+async def fetch_page(client: httpx.AsyncClient,
+                     url: str,
+                     semaphore: asyncio.Semaphore,
+                     limiter: HostRateLimiter,
+                     max_retries: int = 3):
+    host = httpx.URL(url).host
+    async with semaphore:
+        for attempt in range(1, max_retries + 1):
+            await limiter.wait(host)
+            try:
+                res = await client.get(url)
+                res.raise_for_status()
+                return res.text
+            except httpx.HTTPError as e:
+                if attempt == max_retries:
+                    raise
+                logger.warning(f"⚠️ Attempt {attempt} failed for {url}: {e}")
+                await asyncio.sleep(attempt)
+
+
+async def fetch_pages(urls: list,
+                      headers: dict = None,
+                      concurrency: int = 8,
+                      rate_limit: float = 10.0):
+    """Fetch `urls` concurrently over one keep-alive client and yield (position, html) in order."""
+    limits = httpx.Limits(max_connections=concurrency,
+                          max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = HostRateLimiter(rate_limit)
+    async with httpx.AsyncClient(headers=headers,
+                                 limits=limits,
+                                 timeout=30,
+                                 follow_redirects=True) as client:
+        tasks = [asyncio.create_task(fetch_page(client, url, semaphore, limiter)) for url in urls]
+        try:
+            for position, task in enumerate(tasks):
+                yield position, await task
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def iter_pages(urls: list, **kwargs):
+    """Blocking iterator over `fetch_pages`.
+
+    The event loop runs in its own thread, so this works from sync code and
+    from inside an already running loop (e.g. a FastAPI endpoint), and pages
+    keep downloading while the caller parses earlier ones. Closing the
+    generator stops the remaining downloads.
+    """
+    results = queue.Queue()
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        async def consume():
+            async for item in fetch_pages(urls, **kwargs):
+                results.put(item)
+
+        async def run():
+            # the consumer may stop early, downloads still in flight are then cancelled
+            task = asyncio.create_task(consume())
+            while not task.done():
+                if stop.is_set():
+                    task.cancel()
+                    break
+                await asyncio.wait({task}, timeout=0.1)
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        try:
+            asyncio.run(run())
+            results.put(done)
+        except Exception as e:
+            results.put(e)
+
+    thread = threading.Thread(target=produce, name="page-fetcher", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
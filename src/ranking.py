@@ -0,0 +1,210 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from src.database import db
+from src.scoring import MISSING_TRANSPORT_SCORE, TRANSPORT_SCORE_LEVELS, TRANSPORT_TIME_BINS
+
+# the weights are exponents of the stored combined score
+# price * confort * transport / 100, so the default profile reproduces it
+DEFAULT_PROFILE = {"price_weight": 1.0,
+                   "confort_weight": 1.0,
+                   "transport_weight": 1.0,
+                   "transport_bins": [float(b) for b in TRANSPORT_TIME_BINS],
+                   "transport_levels": [float(level) for level in TRANSPORT_SCORE_LEVELS],
+                   "missing_transport_score": float(MISSING_TRANSPORT_SCORE)}
+
+
+def make_profile(**overrides):
+    profile = {**DEFAULT_PROFILE, **{key: value for key, value in overrides.items() if value is not None}}
+    bins = [float(b) for b in profile["transport_bins"]]
+    levels = [float(level) for level in profile["transport_levels"]]
+    if any(later <= earlier for earlier, later in zip(bins, bins[1:])):
+        raise ValueError("transport_bins must be strictly increasing")
+    if len(levels) != len(bins) + 1:
+        raise ValueError("transport_levels needs one more value than transport_bins")
+    if any(not 0 <= score <= 10 for score in levels + [profile["missing_transport_score"]]):
+        raise ValueError("transport scores must be between 0 and 10")
+    if any(profile[key] < 0 for key in ("price_weight", "confort_weight", "transport_weight")):
+        raise ValueError("weights must not be negative")
+    profile["transport_bins"] = bins
+    profile["transport_levels"] = levels
+    return profile
+
+
+def profile_hash(profile: dict, **params):
+    payload = json.dumps({"profile": profile, **params}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+# bumped by ingest, scoring and travel time writes (see db.DataVersion)
+DATASETS = ("listings", "scores", "travel_times")
+
+
+def data_version():
+    return db.get_data_version(*DATASETS)
+
+
+def load_commute_matrix():
+    # stations x destinations journey times plus the walk from each destination
+    destinations = db.get_destinations()
+    times = db.get_station_destination_times()
+    matrix = times.pivot(index="station_code", columns="destination_code", values="travel_time")\
+                  .reindex(columns=list(destinations["destination_code"]))
+    return {"station_rows": {station: i for i, station in enumerate(matrix.index)},
+            "destination_columns": {code: j for j, code in enumerate(matrix.columns)},
+            "matrix": np.ascontiguousarray(matrix.to_numpy(dtype=np.float32)),
+            "walk_time": destinations["walk_time"].to_numpy(dtype=np.float32)}
+
+
+def load_features():
+    """Per-listing features of every scored flat as compact column arrays."""
+    flats = db.FlatsToRent.__table__
+    scores = db.Score.__table__
+    travel = db.StationsTravelTime.__table__
+    codes = db.StationCode.__table__
+    station = func.replace(flats.c.nearest_station, " Station", "")
+    query = (select(flats.c.unique_id,
+                    flats.c.postcode,
+                    scores.c.price_score,
+                    scores.c.confort_score,
+                    flats.c.distance_to_station,
+                    travel.c.travel_time,
+                    travel.c.walk_time,
+                    codes.c.station_code)
+             .select_from(flats
+                          .join(scores, scores.c.unique_id == flats.c.unique_id)
+                          .outerjoin(travel, travel.c.station_name == station)
+                          .outerjoin(codes, codes.c.station_name == station)))
+    with db.engine.connect() as conn:
+        result = conn.execute(query)
+        df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+    distance = df["distance_to_station"].str.replace(" miles", "", regex=False).astype(float)
+    total_trans_tm = distance * 20 + df["travel_time"].astype(float) + df["walk_time"].astype(float)
+    postcodes = pd.Categorical(df["postcode"])
+    commute = load_commute_matrix()
+    return {"unique_id": df["unique_id"].to_numpy(dtype=object),
+            "postcode_categories": {postcode: code for code, postcode in enumerate(postcodes.categories)},
+            "postcode_code": postcodes.codes.astype(np.int32),
+            "price_score": df["price_score"].to_numpy(dtype=np.float32),
+            "confort_score": df["confort_score"].to_numpy(dtype=np.float32),
+            "total_trans_tm": total_trans_tm.to_numpy(dtype=np.float32),
+            "distance": distance.to_numpy(dtype=np.float32),
+            "station_row": df["station_code"].map(commute["station_rows"]).fillna(-1).to_numpy(dtype=np.int32),
+            "commute": commute}
+
+
+def commute_times(features: dict, destinations: list):
+    """Total transport time of every listing to the closest of `destinations`."""
+    commute = features["commute"]
+    unknown = [code for code in destinations if code not in commute["destination_columns"]]
+    if unknown:
+        raise ValueError(f"Unknown destination(s): {', '.join(unknown)}")
+    cols = [commute["destination_columns"][code] for code in destinations]
+    # per station first (few hundred rows), then gathered per listing
+    station_best = np.fmin.reduce(commute["matrix"][:, cols] + commute["walk_time"][cols], axis=1)
+    station_row = features["station_row"]
+    best = np.full(len(station_row), np.nan, dtype=np.float32)
+    known = station_row >= 0
+    best[known] = station_best[station_row[known]]
+    # walking to the nearest station is counted at 20 minutes per mile
+    return features["distance"] * 20 + best
+
+
+def rank_features(features: dict,
+                  profile: dict,
+                  postcode: str = None,
+                  limit: int = 20,
+                  destinations: list = None):
+    rows = np.arange(len(features["unique_id"]))
+    if postcode is not None:
+        code = features["postcode_categories"].get(postcode)
+        if code is None:
+            return pd.DataFrame(columns=["unique_id", "price_score", "confort_score", "transport_score",
+                                         "total_trans_tm", "score"])
+        rows = np.flatnonzero(features["postcode_code"] == code)
+
+    total_trans_tm = commute_times(features, destinations) if destinations else features["total_trans_tm"]
+    total = total_trans_tm[rows]
+    levels = np.asarray(profile["transport_levels"], dtype=np.float32)
+    transport = levels[np.digitize(total, profile["transport_bins"], right=True)]
+    transport[np.isnan(total)] = profile["missing_transport_score"]
+    price = features["price_score"][rows]
+    confort = features["confort_score"][rows]
+
+    weights = profile["price_weight"] + profile["confort_weight"] + profile["transport_weight"]
+    score = (np.power(price, profile["price_weight"])
+             * np.power(confort, profile["confort_weight"])
+             * np.power(transport, profile["transport_weight"])
+             / np.float32(10) ** (weights - 1))
+    # listings missing a price or confort score can't be ranked
+    valid = np.flatnonzero(np.isfinite(score))
+
+    # partial selection of the top `limit`, only those are sorted
+    limit = min(limit, len(valid))
+    top = valid[np.argpartition(-score[valid], limit - 1)[:limit]] if limit else valid
+    top = top[np.argsort(-score[top], kind="stable")]
+    return pd.DataFrame({"unique_id": features["unique_id"][rows[top]],
+                         "price_score": price[top].astype(float),
+                         "confort_score": confort[top].astype(float),
+                         "transport_score": transport[top].astype(float),
+                         "total_trans_tm": total[top].astype(float),
+                         "score": score[top].astype(float)})
+
+
+class Ranker:
+    """Ranks scored listings under per-request scoring profiles.
+
+    Features are loaded once and reloaded when the data version of the
+    listings, scores or travel times changes (checked at most every
+    `refresh_interval` seconds).
+    Rankings are cached by a hash of the profile and filters, and the
+    cache is dropped whenever the features are reloaded.
+    """
+
+    def __init__(self,
+                 cache_size: int = 256,
+                 refresh_interval: float = 5):
+        self.cache_size = cache_size
+        self.refresh_interval = refresh_interval
+        self._features = None
+        self._version = None
+        self._checked_at = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def features(self):
+        with self._lock:
+            if self._features is None or time.monotonic() - self._checked_at > self.refresh_interval:
+                version = data_version()
+                if self._features is None or version != self._version:
+                    self._features = load_features()
+                    self._version = version
+                    self._cache.clear()
+                self._checked_at = time.monotonic()
+            return self._features
+
+    def rank(self,
+             profile: dict,
+             postcode: str = None,
+             limit: int = 20,
+             destinations: list = None):
+        features = self.features()
+        key = profile_hash(profile, postcode=postcode, limit=limit, destinations=destinations)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        ranked = rank_features(features, profile, postcode, limit, destinations)
+        with self._lock:
+            self._cache[key] = ranked
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return ranked
+
+
+ranker = Ranker()
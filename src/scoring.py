@@ -1,110 +1,264 @@
+import datetime
 import numpy as np
 import pandas as pd
-from src.database.db import engine, insert_scores
-from sqlalchemy import text
+from src.database.db import get_score_distribution, insert_scores, select_flats_to_score
 import src.const as const
+from src.snapshots import SCORES_DATASET, write_snapshot
+
+PRICE_SCORE_METRIC = "price_score"
+
+# transport score by total journey time in minutes: <=20, <=30, <=45, <=60, longer
+TRANSPORT_TIME_BINS = np.array([20, 30, 45, 60], dtype=float)
+TRANSPORT_SCORE_LEVELS = np.array([10, 8, 6, 3.5, 1.5])
+# when the journey time is unknown
+MISSING_TRANSPORT_SCORE = 2
+
+def as_array(df: pd.DataFrame, col: str):
+    # contiguous float64 copy of a column, missing values as NaN
+    return np.ascontiguousarray(pd.to_numeric(df[col]).astype(float).to_numpy())
+
+def fill_rooms(nb_bedroom: np.ndarray, nb_bathroom: np.ndarray):
+    # when number of bedroom is missing, it is usually a studio flat;
+    # if no bathroom info available, fill with 1
+    return np.where(np.isnan(nb_bedroom), 1, nb_bedroom), np.where(np.isnan(nb_bathroom), 1, nb_bathroom)
+
+def raw_price_kernel(price: np.ndarray,
+                     nb_bedroom: np.ndarray,
+                     nb_bathroom: np.ndarray,
+                     out: np.ndarray = None):
+    # rooms are expected to be filled already
+    out = np.empty(len(price)) if out is None else out
+    # if there are more than 1 bathroom, we assume there's one ensuite room
+    np.subtract(nb_bathroom, nb_bathroom != 1, out=out)
+    out /= 3
+    out += nb_bedroom
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out /= price
+    return out
+
+def tanh_kernel(scores: np.ndarray,
+                mean: float = None,
+                std: float = None,
+                out: np.ndarray = None):
+    # default to the distribution of the scores being normalised
+    mean = np.nanmean(scores) if mean is None else mean
+    std = np.nanstd(scores, ddof=1) if std is None else std
+    out = np.empty(len(scores)) if out is None else out
+    # Center and scale, then apply tanh and rescale to [0,10]
+    np.subtract(scores, mean, out=out)
+    out /= std * 2
+    np.tanh(out, out=out)
+    out *= 5
+    out += 5
+    return out
+
+def confort_kernel(nb_bedroom: np.ndarray,
+                   nb_bathroom: np.ndarray,
+                   out: np.ndarray = None):
+    # rooms are expected to be filled already
+    out = np.empty(len(nb_bedroom)) if out is None else out
+    # bathroom per bedroom, not counting the ensuite room and its bedroom
+    ensuite = nb_bathroom != 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(nb_bathroom - ensuite, nb_bedroom - ensuite, out=out)
+    out *= 10
+    np.minimum(out, 10, out=out)
+    return out
+
+def transport_kernel(distance: np.ndarray,
+                     travel_time: np.ndarray,
+                     walk_time: np.ndarray,
+                     total_out: np.ndarray = None,
+                     out: np.ndarray = None):
+    total = np.empty(len(distance)) if total_out is None else total_out
+    out = np.empty(len(distance)) if out is None else out
+    # walking to the nearest station is counted at 20 minutes per mile
+    np.multiply(distance, 20, out=total)
+    total += travel_time
+    total += walk_time
+    np.take(TRANSPORT_SCORE_LEVELS, np.digitize(total, TRANSPORT_TIME_BINS, right=True), out=out)
+    out[np.isnan(total)] = MISSING_TRANSPORT_SCORE
+    return total, out
+
+def score_kernel(price: np.ndarray,
+                 nb_bedroom: np.ndarray,
+                 nb_bathroom: np.ndarray,
+                 distance: np.ndarray,
+                 travel_time: np.ndarray,
+                 walk_time: np.ndarray,
+                 mean: float = None,
+                 std: float = None):
+    """Compute all scores over float64 arrays (NaN for missing values).
+
+    Outputs are rows of one preallocated block, returned as a dict of views:
+    price_score_raw, price_score, confort_score, total_trans_tm,
+    transport_score and combined_score. `mean` / `std` of the raw price
+    score default to those of the input.
+    """
+    n = len(price)
+    block = np.empty((6, n))
+    raw, price_scores, confort, total, transport, combined = block
+    nb_bedroom, nb_bathroom = fill_rooms(nb_bedroom, nb_bathroom)
+
+    raw_price_kernel(price, nb_bedroom, nb_bathroom, out=raw)
+    tanh_kernel(raw, mean, std, out=price_scores)
+
+    confort_kernel(nb_bedroom, nb_bathroom, out=confort)
+    transport_kernel(distance, travel_time, walk_time, total_out=total, out=transport)
+
+    np.multiply(price_scores, confort, out=combined)
+    combined *= transport
+    combined /= 100
+    return {"price_score_raw": raw,
+            "price_score": price_scores,
+            "confort_score": confort,
+            "total_trans_tm": total,
+            "transport_score": transport,
+            "combined_score": combined}
 
 def tanh_normalization(df: pd.DataFrame,
                        col_scores: str,
-                       mean: float = 0.001):
-    scores = df[col_scores].astype(float)
-    
-    # Center and scale
-    centered = scores - scores.mean()
-    scaled = centered / (scores.std() * 2) 
+                       mean: float = None,
+                       std: float = None):
+    scores = as_array(df, col_scores)
     #centered = scores - mean
     #scaled = centered / (0.00027 * 2)  # Adjust denominator to control spread
-    
-    print(f"mean: {scores.mean()}")
-    print(f"std: {scores.std()}")
-    # Apply tanh and rescale to [0,10]
-    df[col_scores] = 5 * np.tanh(scaled) + 5
-                          
+    mean = np.nanmean(scores) if mean is None else mean
+    std = np.nanstd(scores, ddof=1) if std is None else std
+    print(f"mean: {mean}")
+    print(f"std: {std}")
+    df[col_scores] = tanh_kernel(scores, mean, std)
     return df
                 
+def raw_price_score(df: pd.DataFrame,
+                    col_price: str,
+                    col_nb_bedroom: str,
+                    col_nb_bathroom: str):
+    nb_bedroom, nb_bathroom = fill_rooms(as_array(df, col_nb_bedroom), as_array(df, col_nb_bathroom))
+    return raw_price_kernel(as_array(df, col_price), nb_bedroom, nb_bathroom)
+
 def price_score(df: pd.DataFrame, 
                 col_price: str, 
                 col_nb_bedroom: str, 
-                col_nb_bathroom: str):
-    # when number of bedroom is missing, it is usually a studio flat
-    df[col_nb_bedroom] = df[col_nb_bedroom].fillna('1').astype(int)
-    # if no bathroom info available, fill with 1
-    df[col_nb_bathroom] = df[col_nb_bathroom].fillna('1').astype(int)
-    df[col_price] = df[col_price].astype(float)
-    # calculate raw score
-    df["price_score"] = np.where(df[col_nb_bathroom] == 1,
-                                 (df[col_nb_bedroom] + df[col_nb_bathroom]/3)/df[col_price],
-                                 # if there are more than 1 bathroom, we assume there's one ensuite room
-                                 (df[col_nb_bedroom] + (df[col_nb_bathroom]-1)/3)/df[col_price])
-    # normalise score
-    df = tanh_normalization(df, "price_score", 1000)
+                col_nb_bathroom: str,
+                mean: float = None,
+                std: float = None):
+    raw = raw_price_score(df, col_price, col_nb_bedroom, col_nb_bathroom)
+    df["price_score_raw"] = raw
+    df["price_score"] = tanh_kernel(raw, mean, std)
     return df
 
 def confort_score(df: pd.DataFrame, 
                 col_nb_bedroom: str, 
                 col_nb_bathroom: str):
-    df[col_nb_bedroom] = df[col_nb_bedroom].astype(int)
-    df[col_nb_bathroom] = df[col_nb_bathroom].astype(int)
-    # calculate raw score
-    df["confort_score"] = np.where(df[col_nb_bathroom] == 1,
-                                   df[col_nb_bathroom]/df[col_nb_bedroom],
-                                   # if there are more than 1 bathroom, we assume there's one ensuite room
-                                   (df[col_nb_bathroom] - 1)/(df[col_nb_bedroom] - 1))
-    # normalise score
-    df["confort_score"] = np.minimum(df["confort_score"] * 10, 10)
+    nb_bedroom, nb_bathroom = fill_rooms(as_array(df, col_nb_bedroom), as_array(df, col_nb_bathroom))
+    df["confort_score"] = confort_kernel(nb_bedroom, nb_bathroom)
     return df
 
 def transport_score(df: pd.DataFrame):
-    df["total_trans_tm"] = df["distance_to_station"] * 20 + df["travel_time"] + df["walk_time"]
-    df["transport_score"] = np.where(df["total_trans_tm"].notna(),
-                                     np.where(df["total_trans_tm"]<=20, 10,
-                                              np.where(df["total_trans_tm"]<=30, 8,
-                                                       np.where(df["total_trans_tm"]<=45, 6,
-                                                                np.where(df["total_trans_tm"]<=60, 3.5, 1.5)))),
-                                                                2)
+    df["total_trans_tm"], df["transport_score"] = transport_kernel(as_array(df, "distance_to_station"),
+                                                                   as_array(df, "travel_time"),
+                                                                   as_array(df, "walk_time"))
     return df
 
-def preprocess_df():
-    with engine.begin() as conn:
-        try:
-            result_flats = conn.execute(text("SELECT * FROM flats_to_rent"))
-            df_flats = pd.DataFrame(data=result_flats, columns=const.col_flat_to_rent)
-            result_travel = conn.execute(text("SELECT * FROM stations_travel_time;"))
-            df_travel = pd.DataFrame(data=result_travel, columns=const.col_travel)
-            df_flats["nearest_station"] = df_flats["nearest_station"].str.replace(" Station","")
-            # combine data
-            df = pd.merge(df_flats,
-                          df_travel,
-                          left_on="nearest_station",
-                          right_on="station_name",
-                          how="left").drop(columns=["station_name"], axis=1)
-            
-            # format the distance values
-            df["distance_to_station"] = df["distance_to_station"].str.replace(" miles", "", regex=False).astype(float)
-            df["distance_to_second_station"] = df["distance_to_second_station"].str.replace(" miles", "", regex=False).astype(float)
-            df["travel_time"] = df["travel_time"].astype(float)
-            df["walk_time"] = df["walk_time"].astype(float)
-            return df
-        except Exception as e:
-            raise e
-        finally:
-            conn.close()
+def format_score_inputs(df: pd.DataFrame):
+    # format the distance values
+    df["distance_to_station"] = df["distance_to_station"].str.replace(" miles", "", regex=False).astype(float)
+    df["distance_to_second_station"] = df["distance_to_second_station"].str.replace(" miles", "", regex=False).astype(float)
+    df["travel_time"] = df["travel_time"].astype(float)
+    df["walk_time"] = df["walk_time"].astype(float)
+    return df
+
+def preprocess_df(only_changed: bool = False,
+                  limit: int = None):
+    # flats joined with the travel time of their nearest station
+    df = select_flats_to_score(only_changed=only_changed, limit=limit)
+    return format_score_inputs(df)
+
+def update_distribution(distribution: dict,
+                        added,
+                        removed=None,
+                        metric: str = PRICE_SCORE_METRIC):
+    """Add (and remove, for rescored listings) raw scores to a running count/sum/sum of squares."""
+    distribution = distribution or {"metric": metric, "count": 0, "total": 0.0, "total_sq": 0.0}
+    added = np.asarray(added, dtype=float)
+    added = added[np.isfinite(added)]
+    removed = np.asarray(removed if removed is not None else [], dtype=float)
+    removed = removed[np.isfinite(removed)]
+    return {"metric": distribution["metric"],
+            "count": int(distribution["count"] + len(added) - len(removed)),
+            "total": float(distribution["total"] + added.sum() - removed.sum()),
+            "total_sq": float(distribution["total_sq"] + (added ** 2).sum() - (removed ** 2).sum())}
+
+def distribution_stats(distribution: dict):
+    # mean and sample standard deviation, as pandas would compute them
+    count = distribution["count"]
+    if count < 2:
+        return None, None
+    mean = distribution["total"] / count
+    variance = (distribution["total_sq"] - distribution["total"] ** 2 / count) / (count - 1)
+    return mean, float(np.sqrt(max(variance, 0.0)))
 
 def combined_score(df: pd.DataFrame,
                    col_price: str, 
                    col_nb_bedroom: str, 
-                   col_nb_bathroom: str):
-    df = price_score(df, col_price, col_nb_bedroom, col_nb_bathroom)
-    df = confort_score(df, col_nb_bedroom, col_nb_bathroom)
-    df = transport_score(df)
-    df["combined_score"] = df["price_score"] * df["confort_score"] * df["transport_score"]/ 100
-    return df
+                   col_nb_bathroom: str,
+                   mean: float = None,
+                   std: float = None):
+    scores = score_kernel(as_array(df, col_price),
+                          as_array(df, col_nb_bedroom),
+                          as_array(df, col_nb_bathroom),
+                          as_array(df, "distance_to_station"),
+                          as_array(df, "travel_time"),
+                          as_array(df, "walk_time"),
+                          mean,
+                          std)
+    return df.assign(**scores)
 
-def score_flats_and_save_res():
-    df = preprocess_df()
-    df = combined_score(df, "price", "number_of_bedroom", "number_of_bathroom")
-    insert_scores(df)
-    return df
+def save_scores(df: pd.DataFrame,
+                distribution: dict,
+                scored_at: datetime.datetime):
+    df["scored_at"] = scored_at
+    saved = insert_scores(df, distribution)
+    # keep a snapshot of this scoring pass, partitioned by postcode and pass date
+    write_snapshot(df[["unique_id", "postcode"] + const.col_scores[1:]].assign(run_time=scored_at),
+                   SCORES_DATASET)
+    return saved
+
+def score_flats_and_save_res(incremental: bool = True,
+                             batch_size: int = 5000):
+    """Score flats and upsert the results into the scores table.
+
+    Incrementally, only listings that are new or whose inputs changed are
+    scored, `batch_size` at a time, and price scores are normalised with the
+    running distribution of all scored listings. A full pass rescores every
+    flat and rebuilds that distribution; it also runs when none exists yet.
+    """
+    scored_at = datetime.datetime.now()
+    distribution = get_score_distribution(PRICE_SCORE_METRIC)
+    if not incremental or distribution is None:
+        df = preprocess_df()
+        df = combined_score(df, "price", "number_of_bedroom", "number_of_bathroom")
+        save_scores(df, update_distribution(None, df["price_score_raw"]), scored_at)
+        return df
+
+    frames = []
+    while True:
+        df = preprocess_df(only_changed=True, limit=batch_size)
+        if df.empty:
+            break
+        distribution = update_distribution(distribution,
+                                           raw_price_score(df, "price", "number_of_bedroom", "number_of_bathroom"),
+                                           df["previous_price_score_raw"])
+        mean, std = distribution_stats(distribution)
+        df = combined_score(df, "price", "number_of_bedroom", "number_of_bathroom", mean, std)
+        if not save_scores(df, distribution, scored_at):
+            break
+        frames.append(df)
+    if not frames:
+        print("✅ No new or changed listings to score.")
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
 
 if __name__ == "__main__":
     df = score_flats_and_save_res()
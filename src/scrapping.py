@@ -1,23 +1,48 @@
 import datetime
+import json
+import math
 import re
 import time
-import numpy as np
+from collections import deque
+from dataclasses import astuple, dataclass
+from typing import Optional
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from bs4 import BeautifulSoup
 import logging
-from .database.db import init_db, insert_dataframe_to_db
+from .database.db import init_db, insert_dataframe_to_db, get_completed_pages, get_known_listings, listing_key, property_id_from_link
+from . import const
+from .driver_pool import StationWorkerPool, make_driver
+from .pagination import iter_pages
+from .snapshots import LISTINGS_DATASET, LISTINGS_SCHEMA, SnapshotWriter
 
 logger = logging.getLogger(__name__)
 
 ts = time.time()
-ct = datetime.datetime.now()
-print("current time:", ct)
+
+BASE_URL = "https://www.rightmove.co.uk"
+# number of listing cards per search results page
+PAGE_SIZE = 24
+
+# detail pages embed their state as `window.PAGE_MODEL = {...}` in a script tag
+PAGE_MODEL_PATTERN = re.compile(r"window\.PAGE_MODEL\s*=\s*(\{.*?\})\s*;?\s*</script>", re.DOTALL)
+
+
+class PagePersistError(Exception):
+    # raised by `wrapper` once all pages were tried, the failed ones have no checkpoint
+    def __init__(self, postcode: str, pages: list):
+        self.postcode = postcode
+        self.pages = pages
+        super().__init__(f"{len(pages)} page(s) of {postcode} could not be persisted: "
+                         f"{', '.join(str(p + 1) for p in pages)}")
+
+
+def search_url(postcode: str,
+               loc_code: str,
+               index: int,
+               base_url: str = BASE_URL):
+    return f"{base_url}/property-to-rent/find.html?searchLocation={postcode}&useLocationIdentifier=true&locationIdentifier=OUTCODE%{loc_code}&radius=0.0&_includeLetAgreed=on&index={index}&sortType=6&channel=RENT&transactionType=LETTING&displayLocationIdentifier={postcode}].html"
 
 def extract(apart, 
             type, 
@@ -44,6 +69,11 @@ def extract(apart,
 
 
 def extract_transport_info(driver, url):
+    # browser fallback only, HTTP-only ingests don't need selenium installed
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
     driver.get(url)
 
     try:
@@ -97,6 +127,41 @@ def extract_transport_info(driver, url):
         return None, None
 
 
+def parse_page_model(html: str):
+    match = PAGE_MODEL_PATTERN.search(html)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1))
+    except ValueError as e:
+        logger.error(f"⚠️ Could not decode embedded page data: {e}")
+        return None
+
+
+def extract_transport_info_http(session, url, headers=None):
+    res = session.get(url, headers=headers, timeout=10)
+    res.raise_for_status()
+    page_model = parse_page_model(res.text)
+    if page_model is None:
+        return None, None
+
+    stations = (page_model.get("propertyData") or {}).get("nearestStations") or []
+    l_name = []
+    l_distance = []
+    for station in stations:
+        name = station.get("name")
+        distance = station.get("distance")
+        if name and distance is not None:
+            # match the "0.3 miles" text shown in the Stations tab
+            l_name.append(name.strip())
+            l_distance.append(f"{float(distance):.1f} {station.get('unit', 'miles').lower()}")
+
+    if l_name and l_distance:
+        return l_name, l_distance
+    else:
+        return None, None
+
+
 def retry_extract_transport_info(driver, url, max_retries=3):
     for attempt in range(1, max_retries + 1):
         print(f"🔄 Attempt {attempt} for {url}")
@@ -109,98 +174,209 @@ def retry_extract_transport_info(driver, url, max_retries=3):
     return None, None
 
 
-def run(url: str, 
-        headers: dict,
-        loc_code: str,
-        l_id: list,
-        l_property_type: list,
-        l_rent: list,
-        l_address: list,
-        l_bedroom: list,
-        l_bathroom: list,
-        l_description: list,
-        l_num_image: list,
-        l_price: list,
-        l_base: list,
-        l_link: list,
-        l_station: list,
-        l_distance: list,
-        l_station_2nd: list,
-        l_distance_2nd: list,
-        page: int,
-        driver):
-    
-    res = requests.get(url, headers=headers) 
-    # check status
-    res.raise_for_status()  
-    soup = BeautifulSoup(res.text, "html.parser")
+def extract_station_info(get_driver,
+                         url: str,
+                         session,
+                         headers: dict = None,
+                         station_source: str = "http",
+                         browser_fallback: bool = True):
+    if station_source == "http":
+        try:
+            station, distance = extract_transport_info_http(session, url, headers)
+        except requests.RequestException as e:
+            logger.error(f"⚠️ Failed to fetch {url}: {e}")
+            station, distance = None, None
+        if (station is not None) & (distance is not None):
+            return station, distance
+        if not browser_fallback:
+            return None, None
+        logger.info(f"ℹ️ No embedded station data for {url}, falling back to browser")
+    elif station_source != "browser":
+        raise ValueError(f"Unsupported station source: {station_source}")
+    return retry_extract_transport_info(get_driver(), url)
+
+
+@dataclass
+class Listing:
+    # one row of flats_to_rent, built per listing card
+    __slots__ = tuple(const.col_flat_to_rent)
+    unique_id: str
+    postcode: str
+    property_type: Optional[str]
+    address: Optional[str]
+    rent: Optional[str]
+    price: Optional[int]
+    base: Optional[str]
+    number_of_bedroom: Optional[int]
+    number_of_bathroom: Optional[int]
+    description: Optional[str]
+    num_image: Optional[int]
+    link: str
+    nearest_station: Optional[str]
+    distance_to_station: Optional[str]
+    second_nearest_station: Optional[str]
+    distance_to_second_station: Optional[str]
+    run_time: datetime.datetime
+    property_id: Optional[str]
+
+
+def to_int(value):
+    match = re.search(r'\d+', value) if value else None
+    return int(match.group(0)) if match else None
+
+
+def parse_listing_cards(html: str,
+                        postcode: str,
+                        loc_code: str,
+                        page: int,
+                        base_url: str = BASE_URL,
+                        run_time: datetime.datetime = None):
+    # one timestamp per scrape run, shared by every listing of the run
+    run_time = run_time or datetime.datetime.now()
+    soup = BeautifulSoup(html, "html.parser")
 
     # This gets the list of apartments
     apartments = soup.find_all("div", class_="PropertyCard_propertyCardContainerWrapper__mcK1Z propertyCard-details")
-    index = 1
-
-    for apart in apartments:
-        # create id: page number + item number + run time
-        id = loc_code + str(page+1) + "|" + str(index) + "|" + str(ct).replace(" ","|")
-        l_id.append(id)
-        # extract property type
-        property_type = extract(apart, "span", "PropertyInformation_propertyType__u8e76")
-        l_property_type.append(property_type)
-        # extract rent
-        rent = extract(apart, "div", "PropertyPrice_price__VL65t")
-        l_rent.append(rent)
-        # extract address
-        address = extract(apart, "address", "PropertyAddress_address__LYRPq")
-        l_address.append(address)
-        # extract number of bedroom
-        bedroom = extract(apart, "span", "PropertyInformation_bedroomsCount___2b5R")
-        l_bedroom.append(bedroom)
-        # extract number of bathroom
-        bathroom = extract(apart, "div", "PropertyInformation_bathContainer__ut8VY", extra_type="span")
-        l_bathroom.append(bathroom)
-        # extract full description
-        description = extract(apart, "p", "PropertyCardSummary_summary__oIv57")
-        l_description.append(description)
-        # extract number of image
-        num_image = extract(apart, "span", "PropertyDetailsLozenge_imageCount___OS_A", extra_type="img", image_count=True)
-        l_num_image.append(num_image)
+
+    for index, apart in enumerate(apartments, start=1):
         # extract rent details
+        rent = extract(apart, "div", "PropertyPrice_price__VL65t")
         match = re.search(r'\d[\d,]*', rent)
-        price = int(match.group(0).replace(',', ''))
-        l_price.append(price)
-        l_base.append(rent[-3:])
         # extract link
         link = extract(apart, "a", "propertyCard-link", href=True)
-        link = "https://www.rightmove.co.uk" + link
-        l_link.append(link)
+        link = base_url + link
+        yield Listing(
+            # rightmove's property id, or page number + item number + run time when the link has none
+            unique_id=listing_key(link, loc_code + str(page+1) + "|" + str(index) + "|" + str(run_time).replace(" ","|")),
+            postcode=postcode,
+            property_type=extract(apart, "span", "PropertyInformation_propertyType__u8e76"),
+            address=extract(apart, "address", "PropertyAddress_address__LYRPq"),
+            rent=rent,
+            price=int(match.group(0).replace(',', '')),
+            base=rent[-3:],
+            number_of_bedroom=to_int(extract(apart, "span", "PropertyInformation_bedroomsCount___2b5R")),
+            number_of_bathroom=to_int(extract(apart, "div", "PropertyInformation_bathContainer__ut8VY", extra_type="span")),
+            description=extract(apart, "p", "PropertyCardSummary_summary__oIv57"),
+            num_image=extract(apart, "span", "PropertyDetailsLozenge_imageCount___OS_A", extra_type="img", image_count=True),
+            link=link,
+            # filled in once the station lookup comes back
+            nearest_station=None,
+            distance_to_station=None,
+            second_nearest_station=None,
+            distance_to_second_station=None,
+            run_time=run_time,
+            property_id=property_id_from_link(link),
+        )
 
-        # scrap the transport info
-        station, distance = retry_extract_transport_info(driver, link)
 
-        if (station is not None) & (distance is not None):
-            l_station.append(station[0]) 
-            l_distance.append(distance[0])
-            l_station_2nd.append(station[1]) 
-            l_distance_2nd.append(distance[1])
+def resolve_transport_info(listing: Listing, future):
+    try:
+        station, distance = future.result()
+    except Exception:
+        station, distance = None, None
+
+    if (station is not None) & (distance is not None):
+        listing.nearest_station = station[0]
+        listing.distance_to_station = distance[0]
+        # some listings only have a single station nearby
+        if len(station) > 1 and len(distance) > 1:
+            listing.second_nearest_station = station[1]
+            listing.distance_to_second_station = distance[1]
+    return listing
+
+
+def split_unchanged_listings(listings: list):
+    # listings already stored with the same rent and description need no detail page visit
+    known = get_known_listings({listing.property_id for listing in listings if listing.property_id})
+    changed, unchanged = [], []
+    for listing in listings:
+        if (listing.rent, listing.description) in known.get(listing.property_id, ()):
+            unchanged.append(listing)
         else:
-            l_station.append(np.nan) 
-            l_distance.append(np.nan)
-            l_station_2nd.append(np.nan) 
-            l_distance_2nd.append(np.nan)
-
-        index = index + 1
-    return 
-
+            changed.append(listing)
+    return changed, unchanged
+
+
+def iter_listing_pages(pages,
+                       postcode: str,
+                       loc_code: str,
+                       pool: StationWorkerPool,
+                       base_url: str = BASE_URL,
+                       incremental: bool = True,
+                       run_time: datetime.datetime = None):
+    """Turn (page, html) pairs into (page, listings, unchanged) with station info resolved.
+
+    Station lookups for a page are queued as soon as its cards are parsed,
+    and a page is yielded, in order, once all of its lookups are back, so
+    parsing of later pages overlaps with the lookups of earlier ones. With
+    `incremental`, listings whose property id is stored with the same rent
+    and description are set aside in `unchanged` before any lookup.
+    """
+    run_time = run_time or datetime.datetime.now()
+    pending = deque()
+
+    def resolve_page():
+        p, listings, unchanged, futures = pending.popleft()
+        return p, [resolve_transport_info(listing, future) for listing, future in zip(listings, futures)], unchanged
+
+    for p, html in pages:
+        print(f"inspecting page: {p+1}...")
+        listings = list(parse_listing_cards(html, postcode, loc_code, p, base_url, run_time))
+        unchanged = []
+        if incremental:
+            listings, unchanged = split_unchanged_listings(listings)
+            if unchanged:
+                print(f"{len(unchanged)} unchanged listings skipped")
+        pending.append((p, listings, unchanged, [pool.submit(listing.link) for listing in listings]))
+        while pending and all(future.done() for future in pending[0][3]):
+            yield resolve_page()
+
+    print(f"waiting for {sum(len(page[1]) for page in pending)} station lookups...")
+    while pending:
+        yield resolve_page()
+
+
+def drop_duplicate_listings(listings: list):
+    # a property can show up twice on a page (e.g. featured), earlier
+    # runs are not checked as they are updated in place by unique_id
+    seen = set()
+    new_listings = []
+    for listing in listings:
+        if listing.unique_id not in seen:
+            seen.add(listing.unique_id)
+            new_listings.append(listing)
+    return new_listings
 
 
 def wrapper(postcode: str,
             loc_code: str,
-            pages: int = 42):
+            pages: int = 42,
+            workers: int = 4,
+            browser: str = "chrome",
+            base_url: str = BASE_URL,
+            station_source: str = "http",
+            concurrency: int = 8,
+            rate_limit: float = 10.0,
+            job_id: str = None,
+            on_page=None,
+            incremental: bool = True,
+            snapshot: bool = True):
+    """Scrape an outcode page by page and persist each page as soon as it is ready.
+
+    Returns the number of listings inserted. `on_page(df_page)` is called
+    with every persisted page. With `incremental`, listings already stored
+    unchanged are skipped before their detail page is fetched. With
+    `snapshot`, persisted pages are also appended to the parquet listings
+    dataset under files/output. Pages that fail to persist don't stop the
+    run, but PagePersistError is raised at the end so the outcode isn't
+    reported as done and a rerun of the same job retries them.
+    """
+    # taken per call: the API runs every scrape in one long-lived process
+    run_time = datetime.datetime.now()
     headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.114 Safari/537.36"
         }
-    index = 0
-    url_first_page = f"https://www.rightmove.co.uk/property-to-rent/find.html?searchLocation={postcode}&useLocationIdentifier=true&locationIdentifier=OUTCODE%{loc_code}&radius=0.0&_includeLetAgreed=on&index=0&sortType=6&channel=RENT&transactionType=LETTING&displayLocationIdentifier={postcode}].html"
+    url_first_page = search_url(postcode, loc_code, 0, base_url)
     res = requests.get(url_first_page, headers=headers) 
     # check status
     res.raise_for_status()  
@@ -208,108 +384,100 @@ def wrapper(postcode: str,
     raw = soup.find("div", class_="ResultsCount_resultsCount__Kqeah")
     number_of_results = raw.find("span").text.strip() if raw and raw.find("span") else None
     number_of_results = int(number_of_results.replace(",", ""))
-
-    l_id = []
-    l_property_type = []
-    l_address = []
-    l_rent = []
-    l_bedroom = []
-    l_bathroom = []
-    l_description = []
-    l_num_image = []
-    l_price = []
-    l_base = []
-    l_link = []
-    l_station = []
-    l_distance = []
-    l_station_2nd = []
-    l_distance_2nd = []
-    driver = webdriver.Safari()
-
-    for p in range(pages):
-        print(f"inspecting page: {p+1}...")
-        url = f"https://www.rightmove.co.uk/property-to-rent/find.html?searchLocation={postcode}&useLocationIdentifier=true&locationIdentifier=OUTCODE%{loc_code}&radius=0.0&_includeLetAgreed=on&index={index}&sortType=6&channel=RENT&transactionType=LETTING&displayLocationIdentifier={postcode}].html"
-    
-        run(url, 
-            headers,
-            loc_code,
-            l_id,
-            l_property_type,
-            l_rent,
-            l_address,
-            l_bedroom,
-            l_bathroom,
-            l_description,
-            l_num_image,
-            l_price,
-            l_base,
-            l_link,
-            l_station,
-            l_distance,
-            l_station_2nd,
-            l_distance_2nd,
-            p,
-            driver
-            )
-        index = index + 24
-        if index >= number_of_results:
-            break
-    
-    driver.quit()
-    
-    data = {"unique_id": l_id,
-            "postcode": [postcode for i in range(len(l_id))],
-            "property_type": l_property_type,
-            "address": l_address,
-            "rent": l_rent,
-            "price": l_price,
-            "base": l_base,
-            "number_of_bedroom": l_bedroom,
-            "number_of_bathroom": l_bathroom,
-            "description": l_description,
-            "num_image": l_num_image,
-            "link": l_link,
-            "nearest_station": l_station,
-            "distance_to_station": l_distance,
-            "second_nearest_station": l_station_2nd,
-            "distance_to_second_station": l_distance_2nd,}
-    
-    df_result = pd.DataFrame(data)
-
-    length_original = len(df_result)
-    df_result = df_result.drop_duplicates(subset=["postcode",
-                                                  "property_type",
-                                                  "address",
-                                                  "rent",
-                                                  "price",
-                                                  "base",
-                                                  "number_of_bedroom",
-                                                  "number_of_bathroom",
-                                                  "description",
-                                                  "link",])
-    length_dedup = len(df_result)
-    if length_dedup < length_original:
-        print(f"{length_original - length_dedup} duplicates found")
-
-    df_result["run_time"] = ct
-
-    # score properties
-    # df_result = sc.combined_score(df_result,
-    #                               "price",
-    #                               "number_of_bedroom",
-    #                               "number_of_bathroom")
-
-    # insert the data into local sql db
-    insert_dataframe_to_db(df_result)
-    return df_result
+    # every page offset is known once we have the result count
+    number_of_pages = max(1, min(pages, math.ceil(number_of_results / PAGE_SIZE)))
+
+    # pages already persisted by an earlier attempt of the same job are skipped
+    completed_pages = get_completed_pages(job_id, postcode) if job_id is not None else set()
+    if completed_pages:
+        print(f"resuming {postcode}: {len(completed_pages)} page(s) already done")
+    remaining_pages = [p for p in range(1, number_of_pages) if p not in completed_pages]
+    urls = [search_url(postcode, loc_code, p * PAGE_SIZE, base_url) for p in remaining_pages]
+
+    def search_pages():
+        # the first page is already downloaded, the rest are fetched concurrently
+        if 0 not in completed_pages:
+            yield 0, res.text
+        fetched = iter_pages(urls,
+                             headers=headers,
+                             concurrency=concurrency,
+                             rate_limit=rate_limit)
+        try:
+            for position, html in fetched:
+                yield remaining_pages[position], html
+        finally:
+            fetched.close()
+
+    # one keep-alive session shared by the workers for detail page fetches
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+    # browser=None disables the selenium fallback entirely
+    pool = StationWorkerPool(lambda get_driver, link: extract_station_info(get_driver,
+                                                                           link,
+                                                                           session,
+                                                                           headers,
+                                                                           station_source,
+                                                                           browser_fallback=browser is not None),
+                             workers=workers,
+                             driver_factory=lambda: make_driver(browser))
+
+    writer = SnapshotWriter(LISTINGS_DATASET, schema=LISTINGS_SCHEMA) if snapshot else None
+    inserted_count = 0
+    failed_pages = []
+    pages = search_pages()
+    listing_pages = iter_listing_pages(pages,
+                                       postcode,
+                                       loc_code,
+                                       pool,
+                                       base_url,
+                                       incremental,
+                                       run_time)
+    try:
+        for p, listings, unchanged in listing_pages:
+            new_listings = drop_duplicate_listings(listings)
+            if len(new_listings) < len(listings):
+                print(f"{len(listings) - len(new_listings)} duplicates found")
+            df_page = pd.DataFrame.from_records([astuple(listing) for listing in new_listings],
+                                                columns=const.col_flat_to_rent)
+            df_seen = pd.DataFrame.from_records([astuple(listing) for listing in unchanged],
+                                                columns=const.col_flat_to_rent)
+
+            # insert the page into local sql db, along with its checkpoint
+            checkpoint = None
+            if job_id is not None:
+                checkpoint = {"job_id": job_id,
+                              "postcode": postcode,
+                              "page": p,
+                              "listings": len(df_page),
+                              "completed_at": datetime.datetime.now()}
+            if insert_dataframe_to_db(df_page, checkpoint, seen=df_seen):
+                inserted_count += len(df_page)
+                if writer is not None:
+                    writer.write(df_page)
+                if on_page is not None:
+                    on_page(df_page)
+            else:
+                failed_pages.append(p)
+    finally:
+        # on cancellation or error, stop fetching search pages and queued station lookups
+        listing_pages.close()
+        pages.close()
+        pool.close()
+        session.close()
+        if writer is not None:
+            writer.close()
+
+    if failed_pages:
+        raise PagePersistError(postcode, failed_pages)
+    return inserted_count
 
 if __name__ == "__main__":
     from sqlalchemy import inspect
     from .database.db import engine
     inspector = inspect(engine)
     print(f"Tables in DB: {inspector.get_table_names()}")
-    if "flats_to_rent" not in inspector.get_table_names():
-        init_db()
+    init_db()
     # location_name = "Elephant-and-Castle"
     # location_code = "5E70312"
     # location_name = "Richmond-Upon-Thames"
@@ -318,7 +486,7 @@ if __name__ == "__main__":
     # location_code = "5E93965"
     postcode = "E14"
     location_code = "5E749"
-    df_result = wrapper(postcode, location_code, pages=1)
-    df_result.to_csv(f"/Users/sqwu/property_api/property_api/files/output/result_{postcode}_{str(ct)}.csv")
+    # the run is exported to files/output/snapshots/listings by wrapper
+    wrapper(postcode, location_code, pages=1)
 
 
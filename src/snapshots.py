@@ -0,0 +1,142 @@
+import glob
+import os
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import src.const as const
+
+# hive-partitioned parquet datasets, e.g. listings/postcode=E14/run_time=2025-07-19/part-*.parquet
+SNAPSHOT_DIR = "./files/output/snapshots"
+LISTINGS_DATASET = os.path.join(SNAPSHOT_DIR, "listings")
+SCORES_DATASET = os.path.join(SNAPSHOT_DIR, "scores")
+TRAVEL_TIME_DATASET = os.path.join(SNAPSHOT_DIR, "stations_travel_time")
+
+PARTITION_COLS = ["postcode", "run_time"]
+
+# fixed listing schema, so a page where a column is all None doesn't
+# write a null-typed file the dataset can't be read back with
+LISTING_TYPES = {"price": pa.int64(),
+                 "number_of_bedroom": pa.int64(),
+                 "number_of_bathroom": pa.int64(),
+                 "num_image": pa.int64()}
+LISTINGS_SCHEMA = pa.schema([(col, LISTING_TYPES.get(col, pa.string())) for col in const.col_flat_to_rent])
+
+
+def write_snapshot(df: pd.DataFrame,
+                   dataset: str,
+                   partition_cols: list = PARTITION_COLS,
+                   compression: str = "zstd",
+                   schema: pa.Schema = None,
+                   basename: str = None):
+    if df.empty:
+        return 0
+    df = df.copy()
+    # partition directories are per run date
+    if "run_time" in partition_cols:
+        df["run_time"] = pd.to_datetime(df["run_time"]).dt.strftime("%Y-%m-%d")
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    partitioning = ds.partitioning(pa.schema([table.schema.field(col) for col in partition_cols]),
+                                   flavor="hive")
+    ds.write_dataset(table,
+                     dataset,
+                     format="parquet",
+                     partitioning=partitioning,
+                     # never overwrite files of earlier runs in the same partition
+                     basename_template=f"{basename or 'part-' + uuid.uuid4().hex}-{{i}}.parquet",
+                     existing_data_behavior="overwrite_or_ignore",
+                     file_options=ds.ParquetFileFormat().make_write_options(compression=compression))
+    return len(df)
+
+
+class SnapshotWriter:
+    """Buffers pages of a run and writes them every `flush_pages` pages.
+
+    Flushing per page (the default) keeps the snapshot in step with the
+    database, so a killed run only loses the pages it never persisted.
+    close() merges the files the run wrote into one file per partition.
+    """
+
+    def __init__(self,
+                 dataset: str = LISTINGS_DATASET,
+                 flush_rows: int = 50_000,
+                 flush_pages: int = 1,
+                 schema: pa.Schema = None,
+                 compression: str = "zstd"):
+        self.dataset = dataset
+        self.flush_rows = flush_rows
+        self.flush_pages = flush_pages
+        self.schema = schema
+        self.compression = compression
+        self.run_id = uuid.uuid4().hex
+        self._frames = []
+        self._rows = 0
+        self._flushes = 0
+
+    def write(self, df: pd.DataFrame):
+        self._frames.append(df)
+        self._rows += len(df)
+        if self._rows >= self.flush_rows or len(self._frames) >= self.flush_pages:
+            self.flush()
+
+    def flush(self):
+        if self._frames:
+            write_snapshot(pd.concat(self._frames, ignore_index=True),
+                           self.dataset,
+                           compression=self.compression,
+                           schema=self.schema,
+                           basename=f"part-{self.run_id}-{self._flushes}")
+            self._flushes += 1
+        self._frames = []
+        self._rows = 0
+
+    def compact(self):
+        files = glob.glob(os.path.join(self.dataset, "**", f"part-{self.run_id}-*.parquet"), recursive=True)
+        partitions = {}
+        for path in files:
+            partitions.setdefault(os.path.dirname(path), []).append(path)
+        for directory, parts in partitions.items():
+            if len(parts) < 2:
+                continue
+            table = ds.dataset(sorted(parts), format="parquet").to_table()
+            # dot files are skipped by dataset discovery until the rename
+            staging = os.path.join(directory, f".part-{self.run_id}.parquet")
+            pq.write_table(table, staging, compression=self.compression)
+            os.replace(staging, os.path.join(directory, f"part-{self.run_id}.parquet"))
+            for path in parts:
+                os.remove(path)
+
+    def close(self):
+        self.flush()
+        if self._flushes > 1:
+            self.compact()
+
+
+def load_snapshot(dataset: str = LISTINGS_DATASET,
+                  columns: list = None,
+                  postcodes: list = None,
+                  since: str = None,
+                  until: str = None,
+                  as_table: bool = False):
+    """Read selected columns and partitions of a snapshot dataset.
+
+    Partition filters (`postcodes`, `since`/`until` run dates as
+    "YYYY-MM-DD") prune whole directories before any file is opened.
+    Returns a pyarrow Table with `as_table`, otherwise a DataFrame.
+    """
+    if not os.path.exists(dataset):
+        return pa.table({}) if as_table else pd.DataFrame(columns=columns)
+    dataset = ds.dataset(dataset, format="parquet", partitioning="hive")
+    condition = None
+    filters = []
+    if postcodes is not None:
+        filters.append(ds.field("postcode").isin(list(postcodes)))
+    if since is not None:
+        filters.append(ds.field("run_time") >= since)
+    if until is not None:
+        filters.append(ds.field("run_time") <= until)
+    for expression in filters:
+        condition = expression if condition is None else condition & expression
+    table = dataset.to_table(columns=columns, filter=condition)
+    return table if as_table else table.to_pandas()
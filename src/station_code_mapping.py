@@ -1,4 +1,7 @@
-from src.database.db import engine, insert_station_mapping_to_db, init_db
+from src.database.db import engine, get_mapped_station_codes, insert_station_mapping_to_db, init_db
+import functools
+import re
+import numpy as np
 import pandas as pd
 import logging
 from sqlalchemy import text
@@ -7,24 +10,96 @@ from sqlalchemy import inspect
 
 logger = logging.getLogger(__name__)
 
-def get_best_match(name, choices, scorer=fuzz.token_sort_ratio, threshold=70):
-    match = process.extractOne(name, choices, scorer=scorer)
-    if match and match[1] >= threshold:
-        return match[0]
-    return None
-
-def map_naptan(df):
-    # load mapping table
-    df_naptan = pd.read_csv("./files/mapping/naptan.csv").drop(columns=["Unnamed: 0"], axis=1)
-    df_naptan["commonName"] = df_naptan["commonName"].str.replace(" Underground Station","").str.replace(" Tram Stop","").str.replace(" DLR Station","")
-    # create df of unique stations 
-    l_stations = list(set(df["nearest_station"].unique()).union(set(df["second_nearest_station"].unique())))
-    df_stations = pd.DataFrame(data=l_stations, columns=["station_name"])
-    df_stations["station_name"] = df_stations["station_name"].str.replace(" Station","")
-    # mapping & save df to local as csv file
-    df_stations['matched_station'] = df_stations['station_name'].apply(lambda x: get_best_match(x, df_naptan['commonName']))
-    df_final = df_stations.merge(df_naptan.drop_duplicates(subset=["commonName"]), left_on='matched_station', right_on='commonName', how='left')
-    df_final = df_final.drop(columns=["commonName"], axis=1)
+NAPTAN_PATH = "./files/mapping/naptan.csv"
+
+# TfL names carry the mode ("Bank Underground Station"), listings say "Bank Station"
+NAPTAN_SUFFIX = re.compile(r" (Underground Station|Tram Stop|DLR Station)$")
+STATION_SUFFIX = re.compile(r"\s+(underground station|dlr station|tram stop|rail station|station)$")
+APOSTROPHE = re.compile(r"['’]")
+PUNCTUATION = re.compile(r"[^\w\s]")
+WHITESPACE = re.compile(r"\s+")
+
+def normalize_station_name(name):
+    name = STATION_SUFFIX.sub("", name.lower().strip()).replace("&", " and ")
+    name = PUNCTUATION.sub(" ", APOSTROPHE.sub("", name))
+    return WHITESPACE.sub(" ", name).strip()
+
+class StationMatcher:
+    """Matches station names to NaPTAN ids.
+
+    Built once: names are normalised up front and indexed, so exact and
+    alias matches are a dict lookup. Only the names left over go through
+    rapidfuzz, in one `process.cdist` call over all candidates.
+    """
+
+    def __init__(self,
+                 naptan: pd.DataFrame = None,
+                 aliases: dict = None,
+                 scorer=fuzz.token_sort_ratio,
+                 threshold: float = 70,
+                 workers: int = -1):
+        if naptan is None:
+            naptan = pd.read_csv(NAPTAN_PATH).drop(columns=["Unnamed: 0"], axis=1)
+        naptan = naptan.assign(commonName=naptan["commonName"].str.replace(NAPTAN_SUFFIX, "", regex=True))
+        naptan = naptan.drop_duplicates(subset=["commonName"])
+        self.names = naptan["commonName"].to_numpy()
+        self.codes = naptan["naptanID"].to_numpy()
+        self.keys = [normalize_station_name(name) for name in self.names]
+        self.scorer = scorer
+        self.threshold = threshold
+        self.workers = workers
+        self.exact = {}
+        for i, key in enumerate(self.keys):
+            self.exact.setdefault(key, i)
+        # {"other spelling": "TfL common name"}
+        for alias, name in (aliases or {}).items():
+            i = self.exact.get(normalize_station_name(name))
+            if i is not None:
+                self.exact[normalize_station_name(alias)] = i
+
+    def match(self, names):
+        names = list(names)
+        keys = [normalize_station_name(name) for name in names]
+        best = np.array([self.exact.get(key, -1) for key in keys], dtype=int)
+        scores = np.where(best >= 0, 100.0, 0.0)
+
+        leftover = np.flatnonzero(best < 0)
+        if len(leftover):
+            similarity = process.cdist([keys[i] for i in leftover],
+                                       self.keys,
+                                       scorer=self.scorer,
+                                       score_cutoff=self.threshold,
+                                       workers=self.workers)
+            candidates = similarity.argmax(axis=1)
+            candidate_scores = similarity[np.arange(len(leftover)), candidates]
+            accepted = candidate_scores >= self.threshold
+            best[leftover[accepted]] = candidates[accepted]
+            scores[leftover] = candidate_scores
+
+        found = best >= 0
+        return pd.DataFrame({"station_name": names,
+                             "matched_station": np.where(found, self.names[best], None),
+                             "naptanID": np.where(found, self.codes[best], None),
+                             "match_score": scores})
+
+@functools.lru_cache(maxsize=1)
+def get_matcher():
+    return StationMatcher()
+
+def map_naptan(df, matcher=None):
+    matcher = matcher or get_matcher()
+    # create list of unique stations
+    l_stations = set(df["nearest_station"].dropna().unique()).union(set(df["second_nearest_station"].dropna().unique()))
+    l_stations = sorted({station.replace(" Station", "") for station in l_stations})
+    # stations matched by earlier runs are never matched again
+    df_known = get_mapped_station_codes().rename(columns={"station_code": "naptanID"})
+    known = set(df_known["station_name"])
+    df_new = matcher.match([station for station in l_stations if station not in known])
+    logger.info(f"Matched {df_new['naptanID'].notna().sum()} of {len(df_new)} new stations, {len(known)} already mapped")
+    insert_station_mapping_to_db(df_new[df_new["naptanID"].notna()])
+    # save df to local as csv file
+    df_final = pd.concat([df_known[df_known["station_name"].isin(l_stations)], df_new.drop(columns=["match_score"])],
+                         ignore_index=True)
     df_final.to_csv("./files/mapping/stations_naptan.csv")
     return df_final
 
@@ -0,0 +1,103 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+logger = logging.getLogger(__name__)
+
+# one row per link between adjacent stations: from_station,to_station,minutes (NaPTAN ids)
+GRAPH_PATH = "./files/mapping/station_graph.csv"
+
+
+class StationGraph:
+    """Offline station-to-station travel times from a network graph.
+
+    `precompute` runs Dijkstra from every destination over the reversed
+    graph in one call and keeps the result as a dense stations x
+    destinations float32 matrix. A lookup is then one array index, and a
+    new destination set is a column selection. `offset` (set by
+    `calibrate`) accounts for waiting and interchange time that the
+    link times leave out.
+    """
+
+    def __init__(self,
+                 edges: pd.DataFrame,
+                 bidirectional: bool = True):
+        edges = edges[["from_station", "to_station", "minutes"]].dropna()
+        if bidirectional:
+            edges = pd.concat([edges,
+                               edges.rename(columns={"from_station": "to_station",
+                                                     "to_station": "from_station"})],
+                              ignore_index=True)
+        # parallel links (e.g. several lines) keep the fastest one
+        edges = edges.groupby(["from_station", "to_station"], as_index=False)["minutes"].min()
+        self.stations = np.array(sorted(set(edges["from_station"]) | set(edges["to_station"])))
+        self.index = {station: i for i, station in enumerate(self.stations)}
+        n = len(self.stations)
+        self.graph = csr_matrix((edges["minutes"].to_numpy(dtype=float),
+                                 (edges["from_station"].map(self.index).to_numpy(),
+                                  edges["to_station"].map(self.index).to_numpy())),
+                                shape=(n, n))
+        self.offset = 0.0
+        self.matrix = None
+        self.destination_index = {}
+
+    @classmethod
+    def from_csv(cls,
+                 path: str = GRAPH_PATH,
+                 bidirectional: bool = True):
+        return cls(pd.read_csv(path), bidirectional)
+
+    def precompute(self, destinations: list = None):
+        # all stations by default, so any destination set is a lookup afterwards
+        destinations = list(self.stations) if destinations is None else \
+            [station for station in dict.fromkeys(destinations) if station in self.index]
+        # distances from each destination over reversed links = times to reach it
+        times = dijkstra(self.graph.T, directed=True, indices=[self.index[d] for d in destinations])
+        times[np.isinf(times)] = np.nan
+        self.matrix = np.ascontiguousarray(times.T, dtype=np.float32)
+        self.destination_index = {station: i for i, station in enumerate(destinations)}
+        logger.info(f"Precomputed travel times for {len(self.stations)} stations to {len(destinations)} destinations")
+        return self
+
+    def raw_times(self, stations: list, destinations: list):
+        # stations x destinations block, NaN where a station is unknown or unreachable
+        rows = np.array([self.index.get(station, -1) for station in stations])
+        cols = np.array([self.destination_index.get(station, -1) for station in destinations])
+        block = np.full((len(rows), len(cols)), np.nan, dtype=np.float32)
+        known_rows, known_cols = rows >= 0, cols >= 0
+        block[np.ix_(known_rows, known_cols)] = self.matrix[np.ix_(rows[known_rows], cols[known_cols])]
+        return block
+
+    def travel_times(self, stations: list, destinations: list):
+        return self.raw_times(stations, destinations) + np.float32(self.offset)
+
+    def travel_time(self, from_station: str, to_station: str):
+        i = self.index.get(from_station)
+        j = self.destination_index.get(to_station)
+        if i is None or j is None or np.isnan(self.matrix[i, j]):
+            return None
+        return float(self.matrix[i, j] + self.offset)
+
+    def calibrate(self, observed: dict):
+        """Fit `offset` to {(from, to): minutes} journey times, e.g. cached TfL results."""
+        pairs = list(observed)
+        raw = np.array([self.raw_times([from_station], [to_station])[0, 0] for from_station, to_station in pairs])
+        actual = np.array([observed[pair] for pair in pairs], dtype=float)
+        known = ~np.isnan(raw) & ~np.isnan(actual)
+        if not known.any():
+            logger.warning("No observed journeys overlap the station graph, offset unchanged")
+            return {"pairs": 0, "offset": self.offset, "mean_abs_error": None}
+        residuals = actual[known] - raw[known]
+        self.offset = float(np.median(residuals))
+        return {"pairs": int(known.sum()),
+                "offset": self.offset,
+                "mean_abs_error": float(np.abs(residuals - self.offset).mean())}
+
+
+def load_station_graph(path: str = GRAPH_PATH):
+    if not os.path.exists(path):
+        return None
+    return StationGraph.from_csv(path).precompute()
@@ -0,0 +1,132 @@
+import asyncio
+import datetime
+import email.utils
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from src.database.db import evict_expired_journey_times, get_cached_journey_times, save_journey_times
+
+logger = logging.getLogger(__name__)
+
+# point at a local stub (see demo/stub_tfl.py) to run without the real API
+TFL_BASE_URL = os.environ.get("TFL_BASE_URL", "https://api.tfl.gov.uk")
+TFL_APP_KEY = os.environ.get("TFL_APP_KEY")
+
+JOURNEY_DATE = "20250710"
+JOURNEY_TIME = "0900"
+# journey times barely change, refetch a pair after this long
+CACHE_TTL = datetime.timedelta(days=30)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def time_band(date: str = JOURNEY_DATE, time: str = JOURNEY_TIME):
+    return f"{date}T{time}"
+
+
+def journey_params(date: str, time: str):
+    params = {"date": date,
+              "time": time,
+              "timeIs": "Departing",
+              "journeyPreference": "LeastTime",
+              "accessibilityPreference": "NoRequirements",
+              "walkingSpeed": "Average",
+              "cyclePreference": "None"}
+    if TFL_APP_KEY:
+        params["app_key"] = TFL_APP_KEY
+    return params
+
+
+def retry_delay(retry_after, default: float):
+    # Retry-After is either seconds or an HTTP-date
+    if retry_after is None:
+        return default
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        until = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return default
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=datetime.timezone.utc)
+    return max((until - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+
+async def fetch_journey_time(client: httpx.AsyncClient,
+                             from_station: str,
+                             to_station: str,
+                             params: dict,
+                             semaphore: asyncio.Semaphore,
+                             max_retries: int = 4,
+                             backoff: float = 0.5):
+    url = f"/Journey/JourneyResults/{from_station}/to/{to_station}"
+    for attempt in range(max_retries):
+        try:
+            async with semaphore:
+                res = await client.get(url, params=params)
+            if res.status_code not in RETRY_STATUS:
+                break
+            delay = retry_delay(res.headers.get("Retry-After"), backoff * 2 ** attempt)
+            logger.warning(f"⚠️ TfL returned {res.status_code} for {from_station} → {to_station}, retrying")
+        except httpx.TransportError as e:
+            res = None
+            delay = backoff * 2 ** attempt
+            logger.warning(f"⚠️ Attempt {attempt + 1} failed for {from_station} → {to_station}: {e}")
+        # back off without holding a connection slot
+        if attempt < max_retries - 1:
+            await asyncio.sleep(delay)
+
+    if res is None or res.status_code != 200:
+        print(f"Error fetching journey from {from_station} to {to_station}")
+        return None
+    journeys = res.json().get("journeys") or []
+    return journeys[0]["duration"] if journeys else None
+
+
+async def fetch_journey_times(pairs: list,
+                              date: str = JOURNEY_DATE,
+                              time: str = JOURNEY_TIME,
+                              concurrency: int = 8,
+                              base_url: str = None):
+    """Fetch durations for (from, to) pairs concurrently over one connection pool."""
+    limits = httpx.Limits(max_connections=concurrency,
+                          max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    params = journey_params(date, time)
+    async with httpx.AsyncClient(base_url=base_url or TFL_BASE_URL,
+                                 limits=limits,
+                                 timeout=30) as client:
+        durations = await asyncio.gather(*[fetch_journey_time(client, from_station, to_station, params, semaphore)
+                                           for from_station, to_station in pairs])
+    return dict(zip(pairs, durations))
+
+
+def get_journey_times(pairs: list,
+                      date: str = JOURNEY_DATE,
+                      time: str = JOURNEY_TIME,
+                      ttl: datetime.timedelta = CACHE_TTL,
+                      concurrency: int = 8,
+                      base_url: str = None):
+    """Durations in minutes for (from, to) NaPTAN pairs, None where TfL had no journey.
+
+    Pairs cached for the same date/time band within `ttl` are served from
+    the journey_time_cache table, only the missing ones are requested.
+    """
+    band = time_band(date, time)
+    evict_expired_journey_times(ttl)
+    pairs = list(dict.fromkeys(pairs))
+    durations = get_cached_journey_times(pairs, band, ttl)
+    missing = [pair for pair in pairs if pair not in durations]
+    logger.info(f"Journey times: {len(durations)} cached, {len(missing)} to fetch")
+    if missing:
+        # own thread and event loop, so this also works when called from a running loop
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            fetched = executor.submit(asyncio.run,
+                                      fetch_journey_times(missing, date, time, concurrency, base_url)).result()
+        # failed lookups are retried on the next run instead of being cached
+        save_journey_times({pair: duration for pair, duration in fetched.items() if duration is not None}, band)
+        durations.update(fetched)
+    return {pair: durations.get(pair) for pair in pairs}
@@ -1,96 +1,129 @@
-from src.database.db import engine, insert_travel_time_to_db
+from src.database.db import (default_destinations, engine, get_destinations, get_mapped_station_codes,
+                             get_station_destination_times, insert_travel_time_to_db, save_destinations,
+                             save_station_destination_times)
+import numpy as np
 import pandas as pd
 import logging
 from sqlalchemy import text
-import requests
+import datetime
+from src.snapshots import TRAVEL_TIME_DATASET, write_snapshot
+from src.tfl import get_journey_times
+from src.station_graph import load_station_graph
 
 logger = logging.getLogger(__name__)
 
-bank_station_code = "940GZZLUBNK"
-aldgate_station_code = "940GZZLUALD"
-liverpool_st_station_code = "940GZZLULVT"
-tower_hill_station_code = "940GZZLUTWH"
-tower_gateway_station_code = "9400ZZDLTWG"
+def get_journey_time(from_station, to_station="940GZZLUAGL"):
+    return get_journey_times([(from_station, to_station)])[(from_station, to_station)]
 
-dict_destination = {bank_station_code: 9,
-             aldgate_station_code: 5,
-             liverpool_st_station_code: 12,
-             tower_hill_station_code: 10,
-             tower_gateway_station_code: 10}
+def seed_destinations():
+    # the original City of London destinations, used when a request doesn't pick its own
+    if get_destinations().empty:
+        save_destinations(default_destinations())
 
-destination_name_mapping = {bank_station_code: "Bank",
-             aldgate_station_code: "Aldgate",
-             liverpool_st_station_code: "Liverpool Street",
-             tower_hill_station_code: "Tower Hill",
-             tower_gateway_station_code: "Tower Gateway"}
+def default_destination_codes():
+    seed_destinations()
+    destinations = get_destinations()
+    return list(destinations.loc[destinations["is_default"].astype(bool), "destination_code"])
 
-def get_journey_time(from_station, to_station="940GZZLUAGL"):
-    url = f"https://api.tfl.gov.uk/Journey/JourneyResults/{from_station}/to/{to_station}?date=20250710&time=0900&timeIs=Departing&journeyPreference=LeastTime&accessibilityPreference=NoRequirements&walkingSpeed=Average&cyclePreference=None"
-    
-    params = {}
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        data = response.json()
-        journey = data['journeys'][0]
-        duration = journey['duration']
-        return duration
-    else:
-        print(f"Error fetching journey from {from_station} to {to_station}")
-        return None
+def calibrate_station_graph(graph, df, sample=20):
+    # a sample of real TfL journeys (cached after the first run) fits the graph's wait/interchange offset
+    pairs = [(station_code, des) for station_code in df["station_code"].head(sample) for des in default_destination_codes()]
+    result = graph.calibrate(get_journey_times(pairs))
+    logger.info(f"Calibrated station graph on {result['pairs']} journeys: offset {result['offset']:.1f} min, "
+                f"mean abs error {result['mean_abs_error']}")
+    return result
 
-def df_get_journey_time(df):
-    dest_list = []
-    dur_list = []
-    walk_tome_list = []
+def fill_station_destination_times(station_codes=None, destination_codes=None, graph=None):
+    """Add the missing station x destination journey times, existing pairs are never re-fetched."""
+    seed_destinations()
+    if station_codes is None:
+        station_codes = get_mapped_station_codes()["station_code"]
+    if destination_codes is None:
+        destination_codes = get_destinations()["destination_code"]
+    station_codes = list(dict.fromkeys(station_codes))
+    destination_codes = list(dict.fromkeys(destination_codes))
+    existing = get_station_destination_times(station_codes, destination_codes)
+    known = set(zip(existing["station_code"], existing["destination_code"]))
+    missing = [(station_code, des) for station_code in station_codes for des in destination_codes
+               if (station_code, des) not in known]
+    if not missing:
+        return 0
 
-    for _, row in df.iterrows():
-        result_dict = {}
-        for des, walk_time in dict_destination.items():
-            try:
-                dur = get_journey_time(row["station_code"], des)
-                total_time = dur + walk_time
-                result_dict[des] = total_time
-            except Exception:
-                result_dict[des] = float(60)  # In case of error, assign large number
+    if graph is not None:
+        # offline lookups in the precomputed station graph, no TfL requests
+        durations = {pair: graph.travel_time(*pair) for pair in missing}
+        source = "graph"
+    else:
+        # one concurrent, cached batch
+        durations = get_journey_times(missing)
+        source = "tfl"
+    df = pd.DataFrame([{"station_code": station_code,
+                        "destination_code": des,
+                        "travel_time": dur,
+                        "source": source}
+                       for (station_code, des), dur in durations.items() if dur is not None])
+    count = save_station_destination_times(df) if not df.empty else 0
+    logger.info(f"Stored {count} of {len(missing)} missing station → destination times")
+    return count
 
-        # Get the destination with minimum duration
-        if result_dict:
-            best_des = min(result_dict, key=result_dict.get)
-            best_des_name = destination_name_mapping[best_des]
-            best_dur = result_dict[best_des]
-            best_wlk_tm = dict_destination[best_des]
-        else:
-            best_des_name = None
-            best_dur = None
-            best_wlk_tm = None
+def add_destinations(destinations, graph=None, default=False):
+    """Register {naptan_id: (name, walk_time)} destinations and fill only their column of the matrix."""
+    seed_destinations()
+    save_destinations(pd.DataFrame([{"destination_code": code,
+                                     "name": name,
+                                     "walk_time": walk_time,
+                                     "is_default": default}
+                                    for code, (name, walk_time) in destinations.items()]))
+    return fill_station_destination_times(destination_codes=list(destinations), graph=graph)
 
-        dest_list.append(best_des_name)
-        dur_list.append(best_dur - best_wlk_tm)
-        walk_tome_list.append(best_wlk_tm)
+def best_destinations(station_codes, destination_codes=None):
+    """Closest destination of the set for each station, as a min over the station x destination matrix."""
+    if destination_codes is None:
+        destination_codes = default_destination_codes()
+    destinations = get_destinations(destination_codes).drop_duplicates("destination_code")
+    codes = list(destinations["destination_code"])
+    walk = destinations["walk_time"].to_numpy(dtype=float)
+    times = get_station_destination_times(list(set(station_codes)), codes)
+    matrix = times.pivot(index="station_code", columns="destination_code", values="travel_time")\
+                  .reindex(index=list(station_codes), columns=codes)
+    total = matrix.to_numpy(dtype=float) + walk
+    # In case of error, assign large number
+    total[np.isnan(total)] = 60
+    best = total.argmin(axis=1)
+    rows = np.arange(len(total))
+    return pd.DataFrame({"station_code": list(station_codes),
+                         "best_destination": destinations["name"].to_numpy()[best],
+                         "min_duration": total[rows, best] - walk[best],
+                         "walk_to_dest": walk[best]})
 
-        print(row["station_name"])
-    
-    df["best_destination"] = dest_list
-    df["min_duration"] = dur_list
-    df["walk_to_dest"] = walk_tome_list
+def df_get_journey_time(df, graph=None, destination_codes=None):
+    fill_station_destination_times(df["station_code"], destination_codes, graph)
+    best = best_destinations(list(df["station_code"]), destination_codes)
+    df["best_destination"] = best["best_destination"].to_numpy()
+    df["min_duration"] = best["min_duration"].to_numpy()
+    df["walk_to_dest"] = best["walk_to_dest"].to_numpy()
     return df
 
-def prepare_stations_naptan_mapping():
+def prepare_stations_naptan_mapping(graph=None):
     with engine.begin() as conn:
         try:
             result = conn.execute(text("SELECT * FROM station_code WHERE station_code IS NOT NULL;"))
             df = pd.DataFrame(data=result, columns=["station_name","station_code"])
             result.close()
-            df = df_get_journey_time(df)
+            df = df_get_journey_time(df, graph)
             insert_travel_time_to_db(df)
             return df
         except Exception:
             raise
 
 if __name__ == "__main__":
-    df = prepare_stations_naptan_mapping()
+    # route offline when a station graph is available, the API then only calibrates it
+    graph = load_station_graph()
+    if graph is not None:
+        calibrate_station_graph(graph, get_mapped_station_codes())
+    df = prepare_stations_naptan_mapping(graph)
     print(df)
-    df.to_excel("/Users/sqwu/property_api/property_api/files/output/stations_travel_time.xlsx")
+    write_snapshot(df.assign(run_time=datetime.datetime.now()), TRAVEL_TIME_DATASET, partition_cols=["run_time"])
     # df = pd.read_excel("/Users/sqwu/property_api/property_api/files/output/stations_travel_time.xlsx")
     # try:
     #     insert_travel_time_to_db(df)